@@ -0,0 +1,78 @@
+import argparse
+import glob
+import json
+import sys
+import time
+
+from src import inference, registry
+from src.class_map import load_class_map
+
+# Checks that the exported inference backends find the same people as the
+# PyTorch checkpoint on the sample videos. A backend passes when every
+# person's presence is within --tolerance seconds of the PyTorch baseline,
+# or within --relative-tolerance of the video's duration if that is larger.
+# Run from packepfecam/backend with the same environment as the API:
+#   python -m benchmarks.backend_parity --backends onnx openvino int8
+
+
+def presence_seconds(video_path: str, class_map, stride: int) -> tuple:
+    started = time.monotonic()
+    counts, fps = inference.analyse_video(video_path, class_map, stride=stride, tracking=False)
+    return {name: frames / fps for name, frames in counts.items()}, time.monotonic() - started
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--videos", default="uploads/*.mp4")
+    parser.add_argument("--class-map", default="/app/FILES/results.json")
+    parser.add_argument("--backends", nargs="+", default=[b for b in registry.BACKENDS if b != "pytorch"])
+    parser.add_argument("--stride", type=int, default=1)
+    parser.add_argument("--tolerance", type=float, default=1.0, help="seconds")
+    parser.add_argument("--relative-tolerance", type=float, default=0.02, help="fraction of the video duration")
+    parser.add_argument("--output", help="also write the report to this JSON file")
+    args = parser.parse_args()
+
+    class_map = load_class_map(args.class_map)
+    videos = sorted(glob.glob(args.videos))
+
+    runs = {}
+    for backend in ["pytorch"] + [b for b in args.backends if b != "pytorch"]:
+        inference.model = registry.get_model(backend)
+        registry.warm_up(inference.model, inference.batch_size)
+        runs[backend] = {video: presence_seconds(video, class_map, args.stride) for video in videos}
+
+    report, passed = [], True
+    for backend in args.backends:
+        if backend == "pytorch":
+            continue
+        for video in videos:
+            baseline, baseline_time = runs["pytorch"][video]
+            seconds, elapsed = runs[backend][video]
+            fps, total_frames = inference.probe_video(video)
+            allowed = max(args.tolerance, args.relative_tolerance * total_frames / fps)
+            deltas = {name: seconds[name] - baseline[name] for name in baseline}
+            ok = all(abs(delta) <= allowed for delta in deltas.values())
+            passed = passed and ok
+            report.append({
+                "backend": backend,
+                "video": video,
+                "passed": ok,
+                "tolerance_seconds": allowed,
+                "max_abs_delta": max((abs(d) for d in deltas.values()), default=0.0),
+                "per_person_delta": deltas,
+                "time": elapsed,
+                "speedup": baseline_time / elapsed if elapsed else None,
+            })
+            print(
+                f"{'PASS' if ok else 'FAIL'} {backend:<8} {video}: max |delta| "
+                f"{report[-1]['max_abs_delta']:.2f}s (tolerance {allowed:.2f}s), {report[-1]['speedup']:.2f}x"
+            )
+
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(report, f, indent=2)
+    sys.exit(0 if passed else 1)
+
+
+if __name__ == "__main__":
+    main()
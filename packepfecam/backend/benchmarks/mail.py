@@ -0,0 +1,85 @@
+import argparse
+import asyncio
+import json
+import time
+
+from . import standins
+
+# Measures what outbound mail costs a request, against the local SMTP
+# stand-in: how long send_verification_email takes to return, and how long
+# the background senders take to deliver everything, with a slow relay
+# (--relay-delay) and with the first connections refused (--fail-connections)
+# to exercise the retries.
+# Run from packepfecam/backend:
+#   python -m benchmarks.mail --messages 200 --relay-delay 0.05
+
+
+def percentile(values: list, fraction: float) -> float:
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * fraction))]
+
+
+async def run(args, delay: float, fail_connections: int) -> dict:
+    from src import mailer, utils
+    from src.config.settings import settings
+
+    relay = standins.SmtpStandin(delay, fail_connections)
+    settings.SMTP_HOST, settings.SMTP_PORT = "127.0.0.1", await relay.start()
+    settings.SMTP_STARTTLS, settings.SMTP_USERNAME = False, ""
+    settings.SMTP_RETRY_SECONDS = args.retry_seconds
+    await mailer.start_senders()
+
+    started = time.monotonic()
+    enqueue = []
+    for i in range(args.messages):
+        call = time.monotonic()
+        await utils.send_verification_email(f"user{i}@example.com", utils.generate_verification_code())
+        enqueue.append(time.monotonic() - call)
+
+    while len(relay.messages) < args.messages and time.monotonic() - started < args.timeout:
+        await asyncio.sleep(0.01)
+    delivered = time.monotonic() - started
+    await mailer.stop_senders()
+    await relay.stop()
+
+    return {
+        "relay_delay": delay,
+        "fail_connections": fail_connections,
+        "messages": args.messages,
+        "delivered": len(relay.messages),
+        "connections": relay.connections,
+        "enqueue_p50_ms": percentile(enqueue, 0.5) * 1000,
+        "enqueue_p99_ms": percentile(enqueue, 0.99) * 1000,
+        "delivery_seconds": delivered,
+    }
+
+
+async def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--messages", type=int, default=100)
+    parser.add_argument("--relay-delay", type=float, default=0.02, help="seconds the stand-in waits before each reply")
+    parser.add_argument("--fail-connections", type=int, default=2)
+    parser.add_argument("--retry-seconds", type=float, default=0.1)
+    parser.add_argument("--timeout", type=float, default=120)
+    parser.add_argument("--output", help="write the results to this JSON file")
+    args = parser.parse_args()
+
+    standins.use_default_env()
+    results = []
+    for delay, fail_connections in ((args.relay_delay, 0), (args.relay_delay, args.fail_connections)):
+        result = await run(args, delay, fail_connections)
+        results.append(result)
+        print(
+            f"relay delay {delay * 1000:.0f}ms, {fail_connections} refused connections: "
+            f"{result['delivered']}/{result['messages']} delivered in {result['delivery_seconds']:.2f}s "
+            f"over {result['connections']} connections, enqueue p50 {result['enqueue_p50_ms']:.2f}ms "
+            f"p99 {result['enqueue_p99_ms']:.2f}ms"
+        )
+
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(results, f, indent=2)
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,260 @@
+import argparse
+import asyncio
+import glob
+import json
+import os
+import platform
+import resource
+import tempfile
+import time
+from datetime import datetime
+
+import cv2
+
+from . import standins
+
+# Benchmarks the presence pipeline on CPU with the sample videos and stills
+# taken from them (or --images). Per video it times each stage in this
+# process (upload write, decode, inference, counting, enrichment and
+# persistence), then the whole job through the inference pool (end to end).
+# Run from packepfecam/backend:
+#   python -m benchmarks.pipeline --tiny-model --output benchmark.json
+# --tiny-model and the default in-memory Mongo stand-in make it runnable
+# anywhere; pass --mongo to use the DATABASE_URL server instead.
+
+
+class UploadRequest:
+    # Just enough of a starlette Request for ingest.receive_video
+    boundary = "benchmarkboundary"
+
+    def __init__(self, filename: str, content: bytes, chunk_size: int = 64 * 1024):
+        self.headers = {"Content-Type": f"multipart/form-data; boundary={self.boundary}"}
+        self.body = (
+            f"--{self.boundary}\r\n"
+            f'Content-Disposition: form-data; name="video_file"; filename="{filename}"\r\n'
+            "Content-Type: video/mp4\r\n\r\n"
+        ).encode() + content + f"\r\n--{self.boundary}--\r\n".encode()
+        self.chunk_size = chunk_size
+
+    async def stream(self):
+        for i in range(0, len(self.body), self.chunk_size):
+            yield self.body[i : i + self.chunk_size]
+
+
+def sample_stills(videos: list, per_video: int) -> list:
+    stills = []
+    for video in videos:
+        cap = cv2.VideoCapture(video)
+        total = int(cap.get(cv2.CAP_PROP_FRAME_COUNT))
+        for index in range(0, total, max(1, total // per_video)):
+            cap.set(cv2.CAP_PROP_POS_FRAMES, index)
+            ret, frame = cap.read()
+            if ret:
+                stills.append((f"{os.path.basename(video)}#{index}", cv2.imencode(".jpg", frame)[1].tobytes()))
+        cap.release()
+    return stills[: per_video * len(videos)]
+
+
+def process_peak_rss_kb(pid: int) -> int:
+    # VmHWM is the peak RSS of a running process, in KiB
+    try:
+        with open(f"/proc/{pid}/status") as f:
+            for line in f:
+                if line.startswith("VmHWM:"):
+                    return int(line.split()[1])
+    except OSError:
+        pass
+    return 0
+
+
+def peak_rss_mb(workers_kb: int) -> dict:
+    # ru_maxrss is in KiB on Linux. The inference processes are forked by the
+    # forkserver, not by this process, so RUSAGE_CHILDREN never sees them; they
+    # are read from /proc before the pool is stopped.
+    return {
+        "main": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024,
+        "children": max(workers_kb, resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss) / 1024,
+    }
+
+
+async def bench_video(video_path: str, class_map, args, tmp: str) -> dict:
+    from src import inference, ingest
+    from src.models.job import VideoJob
+    from src.routes import presence
+
+    with open(video_path, "rb") as f:
+        content = f.read()
+    name = os.path.basename(video_path)
+    runs = []
+    for run in range(args.repeat):
+        timings = {}
+        started = time.monotonic()
+        path, digest, _ = await ingest.receive_video(UploadRequest(name, content), lambda filename: os.path.join(tmp, f"{run}_{filename}"))
+        timings["upload_write"] = time.monotonic() - started
+
+        counts, fps = inference.analyse_video(path, class_map, stride=args.stride, timings=timings)
+        seconds = {name: frames / fps for name, frames in counts.items()}
+        durations = {name: f"{round(s)}sec" for name, s in seconds.items()}
+
+        started = time.monotonic()
+        await presence.add_profiles(durations)
+        timings["enrichment"] = time.monotonic() - started
+
+        started = time.monotonic()
+        await presence.save_to_database(seconds, name, "benchmark")
+        timings["persistence"] = time.monotonic() - started
+
+        # The same upload as a job through the inference pool, as the API runs it
+        started = time.monotonic()
+        path, digest, _ = await ingest.receive_video(UploadRequest(name, content), lambda filename: os.path.join(tmp, f"{run}_job_{filename}"))
+        job = VideoJob(video_name=name, video_path=path, api_key="benchmark", options={"stride": args.stride}, content_digest=digest, created_at=datetime.utcnow())
+        await job.insert()
+        await presence.process_video(job)
+        timings["end_to_end"] = time.monotonic() - started
+
+        pipeline = timings["decode"] + timings["inference"] + timings["counting"]
+        timings["frames_per_second"] = timings["frames"] / pipeline if pipeline else None
+        timings["inference_per_frame"] = timings["inference"] / timings["analysed"] if timings["analysed"] else None
+        runs.append(timings)
+        print(
+            f"{name} run {run + 1}: {timings['frames']} frames at {timings['frames_per_second']:.1f} fps, "
+            + ", ".join(f"{stage} {timings[stage]:.3f}s" for stage in ("upload_write", "decode", "inference", "counting", "enrichment", "persistence", "end_to_end"))
+        )
+    return {"video": video_path, "bytes": len(content), "runs": runs}
+
+
+async def bench_images(stills: list, class_map, args) -> dict:
+    from src import inference
+    from src.routes import image_presence
+
+    runs = []
+    for run in range(args.repeat):
+        timings = {"images": len(stills)}
+        contents = [content for _, content in stills]
+
+        # One image per forward pass, then in batches as the bulk endpoint does
+        started = time.monotonic()
+        analysed = [inference.analyse_images([content], class_map)[0] for content in contents]
+        timings["single_inference"] = time.monotonic() - started
+        started = time.monotonic()
+        for i in range(0, len(contents), inference.batch_size):
+            inference.analyse_images(contents[i : i + inference.batch_size], class_map)
+        timings["batched_inference"] = time.monotonic() - started
+
+        started = time.monotonic()
+        rows = [await image_presence.user_data(name_durations) for name_durations, _ in analysed]
+        timings["enrichment"] = time.monotonic() - started
+        started = time.monotonic()
+        for row in rows:
+            await image_presence.save_to_database(row)
+        timings["persistence"] = time.monotonic() - started
+
+        # Concurrent process_image calls through the micro-batcher and the pool
+        async def request(content):
+            started = time.monotonic()
+            name_durations, _ = await image_presence.image_batcher.submit((content, False))
+            await image_presence.prepare_response(name_durations)
+            return time.monotonic() - started
+
+        started = time.monotonic()
+        latencies = sorted(await asyncio.gather(*[request(content) for content in contents]))
+        timings["end_to_end"] = time.monotonic() - started
+        timings["latency_p50"] = latencies[len(latencies) // 2]
+        timings["latency_p99"] = latencies[min(len(latencies) - 1, int(0.99 * len(latencies)))]
+        timings["images_per_second"] = len(contents) / timings["batched_inference"]
+        runs.append(timings)
+        print(
+            f"{len(contents)} images run {run + 1}: single {timings['single_inference']:.3f}s, batched {timings['batched_inference']:.3f}s, "
+            f"p50 {timings['latency_p50'] * 1000:.0f}ms, p99 {timings['latency_p99'] * 1000:.0f}ms"
+        )
+    return {"runs": runs}
+
+
+async def run(args) -> dict:
+    from src import inference, registry, workers
+    from src.class_map import load_class_map
+    from src.config.database import startDB
+    from src.config.settings import settings
+    from src.models.user import User
+    from src.routes import image_presence, presence
+
+    # Point the routes at local files instead of the container's /app paths
+    tmp = tempfile.mkdtemp(prefix="benchmark-")
+    presence.names_json_file = image_presence.names_json_file = args.class_map
+    presence.output_json_file = os.path.join(tmp, "name_durations.json")
+    class_map = load_class_map(args.class_map)
+
+    await startDB()
+    if not args.mongo:
+        # Profiles to enrich the reports with
+        for i, name in enumerate(class_map.names):
+            await User(username=name, email=f"{name}@example.com", phone_number=f"{i:08d}", password="-", department="-", role="-").insert()
+
+    started = time.monotonic()
+    inference.model = registry.get_model()
+    model_load = time.monotonic() - started
+    started = time.monotonic()
+    registry.warm_up(inference.model, inference.batch_size)
+    warm_up = time.monotonic() - started
+
+    workers.start_pool()
+    await workers.warm_up()
+    try:
+        videos = sorted(glob.glob(args.videos))
+        video_results = [await bench_video(video, class_map, args, tmp) for video in videos]
+        stills = [(os.path.basename(p), open(p, "rb").read()) for p in sorted(glob.glob(args.images))] if args.images else sample_stills(videos, args.stills)
+        image_results = await bench_images(stills, class_map, args) if stills else None
+    finally:
+        workers_kb = max([process_peak_rss_kb(pid) for pid in workers.pool._processes] or [0])
+        workers.stop_pool(wait=True)
+
+    return {
+        "environment": {
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "cpus": os.cpu_count(),
+            "model": settings.MODEL_PATH,
+            "backend": settings.INFERENCE_BACKEND,
+            "batch_size": inference.batch_size,
+            "inference_processes": settings.INFERENCE_PROCESSES,
+            "stride": args.stride,
+            "mongo": "server" if args.mongo else "in-memory stand-in",
+        },
+        "model_load": model_load,
+        "warm_up": warm_up,
+        "videos": video_results,
+        "images": image_results,
+        "peak_rss_mb": peak_rss_mb(workers_kb),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--videos", default="uploads/*.mp4")
+    parser.add_argument("--images", help="glob of still images; by default stills are taken from the videos")
+    parser.add_argument("--stills", type=int, default=8, help="stills taken from each video")
+    parser.add_argument("--class-map", default="FILES/results.json")
+    parser.add_argument("--stride", type=int, default=1)
+    parser.add_argument("--repeat", type=int, default=1)
+    parser.add_argument("--tiny-model", action="store_true", help="use an untrained YOLOv8n instead of MODEL_PATH")
+    parser.add_argument("--mongo", action="store_true", help="use the DATABASE_URL server instead of the in-memory stand-in")
+    parser.add_argument("--output", help="write the results to this JSON file")
+    args = parser.parse_args()
+
+    standins.use_default_env()
+    if args.tiny_model:
+        os.environ["MODEL_PATH"] = standins.tiny_model(os.path.join(tempfile.gettempdir(), "benchmark-yolov8n.pt"))
+    if not args.mongo:
+        standins.use_mongo_standin()
+    # Every run must go through the model
+    os.environ["RESULT_CACHE_ENABLED"] = "false"
+
+    results = asyncio.run(run(args))
+    print(f"Peak RSS: {results['peak_rss_mb']['main']:.0f} MB (API process), {results['peak_rss_mb']['children']:.0f} MB (largest inference process)")
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(results, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,106 @@
+import asyncio
+import os
+
+# Local stand-ins so the benchmarks run on any Linux box without MongoDB,
+# a .env file or the trained weights. Call these before importing src.
+
+# Only used when the environment does not provide them
+DEFAULT_ENV = {
+    "DATABASE_URL": "mongodb://localhost:27017/benchmark",
+    "MONGO_INITDB_DATABASE": "benchmark",
+    "JWT_PUBLIC_KEY": "unused",
+    "JWT_PRIVATE_KEY": "unused",
+    "REFRESH_TOKEN_EXPIRES_IN": "60",
+    "ACCESS_TOKEN_EXPIRES_IN": "15",
+    "JWT_ALGORITHM": "RS256",
+    "CLIENT_ORIGIN": "http://localhost:3000",
+}
+
+
+def use_default_env():
+    for name, value in DEFAULT_ENV.items():
+        os.environ.setdefault(name, value)
+
+
+def use_mongo_standin():
+    # In-memory MongoDB from mongomock-motor in place of a server
+    import motor.motor_asyncio
+    from mongomock_motor import AsyncMongoMockClient
+
+    motor.motor_asyncio.AsyncIOMotorClient = AsyncMongoMockClient
+
+
+def tiny_model(path: str) -> str:
+    # An untrained YOLOv8n built from its yaml: the smallest detector of the
+    # same family, needing no download. It finds (almost) nobody, so it is
+    # only good for timing the pipeline around the model.
+    if not os.path.exists(path):
+        import torch
+        from ultralytics import YOLO
+
+        model = YOLO("yolov8n.yaml")
+        torch.save({"model": model.model, "train_args": {"imgsz": 640}}, path)
+    return path
+
+
+class SmtpStandin:
+    # A local SMTP server that accepts everything and keeps the messages, to
+    # point the mailer at (SMTP_STARTTLS=false, SMTP_USERNAME empty). The
+    # first fail_connections connections are turned away with a 421, and
+    # every reply can be delayed to play a slow relay.
+
+    def __init__(self, delay: float = 0, fail_connections: int = 0):
+        self.delay = delay
+        self.fail_connections = fail_connections
+        self.connections = 0
+        self.messages = []
+        self.server = None
+
+    async def start(self, host: str = "127.0.0.1", port: int = 0) -> int:
+        self.server = await asyncio.start_server(self.session, host, port)
+        return self.server.sockets[0].getsockname()[1]
+
+    async def stop(self):
+        self.server.close()
+        await self.server.wait_closed()
+
+    async def session(self, reader, writer):
+        self.connections += 1
+
+        async def reply(line: str):
+            await asyncio.sleep(self.delay)
+            writer.write(f"{line}\r\n".encode())
+            await writer.drain()
+
+        try:
+            if self.connections <= self.fail_connections:
+                await reply("421 standin busy")
+                return
+            await reply("220 standin")
+            sender, recipients = None, []
+            while line := await reader.readline():
+                command = line.decode().strip().upper()
+                if command.startswith(("EHLO", "HELO")):
+                    await reply("250 standin")
+                elif command.startswith("MAIL FROM:"):
+                    sender, recipients = line.decode().strip()[10:], []
+                    await reply("250 OK")
+                elif command.startswith("RCPT TO:"):
+                    recipients.append(line.decode().strip()[8:])
+                    await reply("250 OK")
+                elif command == "DATA":
+                    await reply("354 End data with <CR><LF>.<CR><LF>")
+                    data = []
+                    while (line := await reader.readline()) not in (b".\r\n", b""):
+                        data.append(line)
+                    self.messages.append((sender, recipients, b"".join(data)))
+                    await reply("250 OK")
+                elif command in ("RSET", "NOOP"):
+                    await reply("250 OK")
+                elif command == "QUIT":
+                    await reply("221 Bye")
+                    return
+                else:
+                    await reply("502 Command not implemented")
+        finally:
+            writer.close()
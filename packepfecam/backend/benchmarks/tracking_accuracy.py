@@ -0,0 +1,74 @@
+import argparse
+import glob
+import json
+import time
+
+from src import inference, registry
+from src.class_map import load_class_map
+
+# Compares tracking mode (detector on every k-th frame, ByteTrack in between)
+# with the every-frame detector baseline on the sample videos.
+# Run from packepfecam/backend with the same environment as the API:
+#   python -m benchmarks.tracking_accuracy --videos "uploads/*.mp4" --keyframes 2 4 8
+
+
+def run(video_path, class_map, **options):
+    started = time.monotonic()
+    counts, fps = inference.analyse_video(video_path, class_map, **options)
+    return {name: frames / fps for name, frames in counts.items()}, time.monotonic() - started
+
+
+def compare(baseline: dict, durations: dict) -> dict:
+    errors = {name: durations[name] - seconds for name, seconds in baseline.items()}
+    total = sum(baseline.values())
+    return {
+        "per_person_delta": errors,
+        "mean_abs_delta": sum(abs(e) for e in errors.values()) / max(1, len(errors)),
+        "relative_delta": sum(abs(e) for e in errors.values()) / total if total else 0.0,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--videos", default="uploads/*.mp4")
+    parser.add_argument("--class-map", default="/app/FILES/results.json")
+    parser.add_argument("--keyframes", type=int, nargs="+", default=[2, 4, 8])
+    parser.add_argument("--output", help="also write the report to this JSON file")
+    args = parser.parse_args()
+
+    inference.model = registry.get_model()
+    registry.warm_up(inference.model, inference.batch_size)
+    class_map = load_class_map(args.class_map)
+
+    report = []
+    for video_path in sorted(glob.glob(args.videos)):
+        baseline, baseline_time = run(video_path, class_map, stride=1, tracking=False)
+        entry = {"video": video_path, "baseline_seconds": baseline, "baseline_time": baseline_time, "runs": []}
+        for k in args.keyframes:
+            for tracking in (False, True):
+                durations, elapsed = run(video_path, class_map, stride=k, tracking=tracking)
+                entry["runs"].append({
+                    "keyframe_interval": k,
+                    "tracking": tracking,
+                    "time": elapsed,
+                    "speedup": baseline_time / elapsed if elapsed else None,
+                    **compare(baseline, durations),
+                })
+        report.append(entry)
+
+        print(video_path)
+        print(f"  baseline (every frame): {baseline_time:.1f}s")
+        for r in entry["runs"]:
+            mode = "tracking" if r["tracking"] else "stride  "
+            print(
+                f"  k={r['keyframe_interval']:<2} {mode} {r['time']:.1f}s ({r['speedup']:.1f}x)"
+                f"  mean |delta| {r['mean_abs_delta']:.2f}s  relative {r['relative_delta']:.1%}"
+            )
+
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(report, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,110 @@
+import argparse
+import asyncio
+from collections import defaultdict
+
+from pymongo import UpdateOne
+
+from src import reports
+from src.config.database import startDB
+from src.models.response import VideoResponse
+from src.models.rollup import AttendanceRollup
+from src.profiles import get_profiles
+
+# Moves video reports from the old schema (names: {name: "6sec"} or
+# {name: {"duration": "6sec", "email": ..., ...}}) to numeric seconds keyed by
+# user id, then rebuilds the attendance rollups from every report. Safe to
+# run again; stop the API first so no report is counted twice in the rollups.
+# Run from packepfecam/backend with the same environment as the API:
+#   python -m migrations.compact_reports
+
+
+def legacy_seconds(value) -> float:
+    duration = value.get("duration") if isinstance(value, dict) else value
+    try:
+        return float(str(duration).removesuffix("sec"))
+    except ValueError:
+        return 0.0
+
+
+async def compact_reports(batch_size: int) -> int:
+    collection = VideoResponse.get_motor_collection()
+    converted = 0
+    while True:
+        batch = await collection.find({"names": {"$exists": True}}, {"names": 1}).limit(batch_size).to_list(length=batch_size)
+        if not batch:
+            return converted
+        profiles = await get_profiles({name for doc in batch for name in doc["names"]})
+        updates = []
+        for doc in batch:
+            seconds, unknown = {}, {}
+            for name, value in doc["names"].items():
+                profile = profiles[name]
+                if profile:
+                    seconds[str(profile["_id"])] = legacy_seconds(value)
+                else:
+                    unknown[name] = legacy_seconds(value)
+            updates.append(
+                UpdateOne(
+                    {"_id": doc["_id"], "names": {"$exists": True}},
+                    {"$set": {"seconds": seconds, "unknown": unknown}, "$unset": {"names": ""}},
+                )
+            )
+        await collection.bulk_write(updates, ordered=False)
+        converted += len(batch)
+        print(f"Converted {converted} reports")
+
+
+async def rebuild_rollups(batch_size: int) -> int:
+    # Totals are summed here, then written once; memory grows with people x days, not with reports
+    totals = defaultdict(lambda: [0.0, 0, 0])  # (period, start, person) -> seconds, reports, present
+    unknown = set()
+    cursor = VideoResponse.get_motor_collection().find({}, {"seconds": 1, "unknown": 1, "date": 1}, batch_size=batch_size)
+    async for doc in cursor:
+        people = list(doc.get("seconds", {}).items()) + list(doc.get("unknown", {}).items())
+        unknown.update(doc.get("unknown", {}))
+        for period in reports.PERIODS:
+            start = reports.period_start(doc["date"], period)
+            for person, seconds in people:
+                total = totals[(period, start, person)]
+                total[0] += seconds
+                total[1] += 1
+                total[2] += int(seconds > 0)
+
+    users = await reports.users_by_id({person for _, _, person in totals if person not in unknown})
+    rollups = AttendanceRollup.get_motor_collection()
+    await rollups.delete_many({})
+    documents = []
+    for (period, start, person), (seconds, count, present) in totals.items():
+        user = users.get(person, {})
+        documents.append({
+            "period": period,
+            "start": start,
+            "person": person,
+            "name": user.get("username", person),
+            "department": user.get("department"),
+            "seconds": seconds,
+            "reports": count,
+            "present": present,
+        })
+        if len(documents) == batch_size:
+            await rollups.insert_many(documents)
+            documents = []
+    if documents:
+        await rollups.insert_many(documents)
+    return len(totals)
+
+
+async def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--batch-size", type=int, default=1000)
+    parser.add_argument("--skip-rollups", action="store_true", help="only convert the reports")
+    args = parser.parse_args()
+
+    await startDB()
+    print(f"Converted {await compact_reports(args.batch_size)} reports in total")
+    if not args.skip_rollups:
+        print(f"Rebuilt {await rebuild_rollups(args.batch_size)} rollups")
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,97 @@
+import json
+import os
+import tempfile
+import time
+
+from bson import ObjectId
+
+from .config.settings import settings
+
+
+class ArtifactStore:
+    # Files produced by a request (annotated image, results JSON), kept under
+    # the request's id for its owner to download. They are written to a
+    # directory every API worker shares, so a download can be answered by any
+    # of them. The total size is bounded: the least recently used artifacts
+    # are evicted first, and any older than max_age seconds are dropped.
+    # The directory is only scanned when this process's running total passes
+    # max_bytes, or once SCAN_SECONDS have gone by, and eviction frees down to
+    # LOW_WATER of max_bytes so the next scan is many puts away.
+    # The methods block on the disk; call them from a thread.
+
+    SCAN_SECONDS = 60
+    LOW_WATER = 0.9
+
+    def __init__(self, directory: str, max_bytes: int, max_age: float):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.max_age = max_age
+        # Bytes in the directory at the last scan plus what this process wrote
+        # since; other processes' writes are picked up by the periodic scan
+        self.size = 0
+        self.scanned = None
+
+    def path(self, artifact_id: str, kind: str):
+        # Ids come from the download URL, so only ones this store hands out map to a file
+        if not ObjectId.is_valid(artifact_id) or not kind.isalnum():
+            return None
+        return os.path.join(self.directory, f"{artifact_id}.{kind}")
+
+    def put(self, artifact_id: str, kind: str, owner: str, data: bytes, media_type: str):
+        path = self.path(artifact_id, kind)
+        if not path or len(data) > self.max_bytes:
+            return
+        os.makedirs(self.directory, exist_ok=True)
+        # The owner and media type go on the first line; renamed into place so
+        # other workers never read a partial file
+        header = json.dumps({"owner": owner, "media_type": media_type}).encode()
+        with tempfile.NamedTemporaryFile(dir=self.directory, suffix=".tmp", delete=False) as f:
+            f.write(header + b"\n" + data)
+        os.replace(f.name, path)
+        self.size += len(header) + 1 + len(data)
+        if self.size > self.max_bytes or self.scanned is None or time.monotonic() - self.scanned > self.SCAN_SECONDS:
+            self.evict()
+
+    def get(self, artifact_id: str, kind: str, owner: str):
+        # (data, media type), or None if it is unknown, evicted or not the owner's
+        path = self.path(artifact_id, kind)
+        try:
+            if not path or os.path.getmtime(path) < time.time() - self.max_age:
+                return None
+            with open(path, "rb") as f:
+                header, data = f.read().split(b"\n", 1)
+            header = json.loads(header)
+            if header["owner"] != owner:
+                return None
+            # Marks it recently used
+            os.utime(path)
+        except FileNotFoundError:
+            return None
+        return data, header["media_type"]
+
+    def evict(self):
+        files = []  # (last used, size, path)
+        with os.scandir(self.directory) as entries:
+            for entry in entries:
+                try:
+                    stat = entry.stat()
+                except FileNotFoundError:
+                    continue
+                files.append((stat.st_mtime, stat.st_size, entry.path))
+        files.sort()
+        size = sum(size for _, size, _ in files)
+        target = self.max_bytes * self.LOW_WATER if size > self.max_bytes else self.max_bytes
+        expired = time.time() - self.max_age
+        for used, file_size, path in files:
+            if used >= expired and size <= target:
+                break
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+            size -= file_size
+        self.size = size
+        self.scanned = time.monotonic()
+
+
+store = ArtifactStore(settings.ARTIFACT_DIR, settings.ARTIFACT_STORE_BYTES, settings.ARTIFACT_MAX_AGE)
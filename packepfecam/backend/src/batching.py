@@ -0,0 +1,80 @@
+import asyncio
+import time
+from collections import deque
+
+from . import metrics
+
+
+class MicroBatcher:
+    # Collects the calls that arrive within `window` seconds of the first one,
+    # or until max_size are waiting, and runs them as one batch. run_batch
+    # gets the list of items and returns one result per item.
+
+    def __init__(self, name: str, run_batch, max_size: int, window: float, history: int = 1000):
+        self.name = name
+        self.run_batch = run_batch
+        self.max_size = max(1, max_size)
+        self.window = window
+        self.pending = []
+        self.timer = None
+        # The loop only keeps weak references to tasks; these keep the running batches alive
+        self.tasks = set()
+        metrics.QUEUE_DEPTH.labels(f"{name}_batch").set_function(lambda: len(self.pending))
+        self.batches = 0
+        self.items = 0
+        self.delays = deque(maxlen=history)  # seconds each recent item waited for its batch
+
+    async def submit(self, item):
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        self.pending.append((item, future, time.monotonic()))
+        if len(self.pending) >= self.max_size:
+            self.flush()
+        elif len(self.pending) == 1:
+            self.timer = loop.call_later(self.window, self.flush)
+        return await future
+
+    def flush(self):
+        if self.timer:
+            self.timer.cancel()
+            self.timer = None
+        batch, self.pending = self.pending, []
+        if batch:
+            task = asyncio.create_task(self.dispatch(batch))
+            self.tasks.add(task)
+            task.add_done_callback(self.tasks.discard)
+
+    async def dispatch(self, batch):
+        now = time.monotonic()
+        self.batches += 1
+        self.items += len(batch)
+        self.delays.extend(now - enqueued for _, _, enqueued in batch)
+        metrics.BATCH_SIZE.labels(self.name).observe(len(batch))
+        for _, _, enqueued in batch:
+            metrics.stage(f"{self.name}_batch_wait", now - enqueued)
+        try:
+            results = await self.run_batch([item for item, _, _ in batch])
+        except Exception as e:
+            for _, future, _ in batch:
+                if not future.done():
+                    future.set_exception(e)
+            return
+        for (_, future, _), result in zip(batch, results):
+            if not future.done():
+                future.set_result(result)
+
+    def stats(self) -> dict:
+        delays = sorted(self.delays)
+
+        def percentile(p):
+            return round(delays[min(len(delays) - 1, int(p * len(delays)))] * 1000, 2) if delays else None
+
+        return {
+            "batches": self.batches,
+            "requests": self.items,
+            "max_batch_size": self.max_size,
+            "window_ms": self.window * 1000,
+            "mean_batch_size": round(self.items / self.batches, 2) if self.batches else None,
+            "fill_rate": round(self.items / (self.batches * self.max_size), 3) if self.batches else None,
+            "queue_delay_ms": {"p50": percentile(0.5), "p99": percentile(0.99), "max": percentile(1)},
+        }
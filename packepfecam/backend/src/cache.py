@@ -0,0 +1,132 @@
+import hashlib
+import json
+import os
+from datetime import datetime, timedelta
+
+from beanie.operators import In
+
+from .config.settings import settings
+from .models.cache import CachedResult
+
+
+# Video results cached by content. The key also covers the model weights, the
+# class map and the sampling options as resolved against the settings, so
+# changing any of them misses the cache. Entries for old weights or class maps
+# are dropped on the next eviction pass; ones for old settings age out.
+
+digests = {}
+
+# Options that change how a video is processed but not its result
+NEUTRAL_OPTIONS = {"segments"}
+
+
+def file_digest(path: str) -> str:
+    stat = os.stat(path)
+    cached = digests.get(path)
+    if not cached or cached[0] != (stat.st_mtime, stat.st_size):
+        h = hashlib.sha256()
+        with open(path, "rb") as f:
+            for block in iter(lambda: f.read(1024 * 1024), b""):
+                h.update(block)
+        cached = digests[path] = ((stat.st_mtime, stat.st_size), h.hexdigest())
+    return cached[1]
+
+
+def versions(class_map_path: str):
+    model_version = file_digest(settings.MODEL_PATH)
+    # Exported backends detect slightly differently from the checkpoint
+    if settings.INFERENCE_BACKEND != "pytorch":
+        model_version += f"-{settings.INFERENCE_BACKEND}"
+    return model_version, file_digest(class_map_path)
+
+
+def effective_options(options: dict) -> dict:
+    # Options left unset fall back to the deployment settings, which decide
+    # the result just as much, so the key is built from what actually applies
+    tracking = settings.TRACKING if options.get("tracking") is None else options["tracking"]
+    effective = {
+        "stride": max(1, int(options.get("stride") or settings.FRAME_STRIDE)),
+        "max_fps": options.get("max_fps") or settings.MAX_ANALYSED_FPS,
+        "time_budget": options.get("time_budget") or settings.PROCESSING_TIME_BUDGET,
+        "tracking": bool(tracking),
+    }
+    if tracking:
+        effective["track_high_thresh"] = settings.TRACK_HIGH_THRESH
+        effective["track_max_lost_seconds"] = settings.TRACK_MAX_LOST_SECONDS
+    # Anything else a request passes, except options that never change the result
+    effective.update({k: v for k, v in options.items() if k not in NEUTRAL_OPTIONS and k not in effective})
+    return effective
+
+
+def cache_key(content_digest: str, options: dict, class_map_path: str) -> str:
+    model_version, class_map_version = versions(class_map_path)
+    options = effective_options(options)
+    raw = json.dumps([content_digest, model_version, class_map_version, options], sort_keys=True)
+    return hashlib.sha256(raw.encode()).hexdigest()
+
+
+async def lookup(content_digest: str, options: dict, class_map_path: str):
+    if not settings.RESULT_CACHE_ENABLED:
+        return None
+    entry = await CachedResult.find_one(CachedResult.key == cache_key(content_digest, options, class_map_path))
+    if entry:
+        await entry.set({CachedResult.last_used: datetime.utcnow(), CachedResult.hits: entry.hits + 1})
+    return entry
+
+
+async def seen_fingerprint(fingerprint: str, class_map_path: str) -> bool:
+    # A matching moov box means the same encoded stream was very likely cached
+    if not settings.RESULT_CACHE_ENABLED or not fingerprint:
+        return False
+    model_version, class_map_version = versions(class_map_path)
+    entry = await CachedResult.find_one(
+        CachedResult.fingerprint == fingerprint,
+        CachedResult.model_version == model_version,
+        CachedResult.class_map_version == class_map_version,
+    )
+    return entry is not None
+
+
+async def store(content_digest: str, fingerprint: str, options: dict, class_map_path: str, name_frames: dict, fps: float):
+    if not settings.RESULT_CACHE_ENABLED:
+        return
+    model_version, class_map_version = versions(class_map_path)
+    now = datetime.utcnow()
+    key = cache_key(content_digest, options, class_map_path)
+    await CachedResult.get_motor_collection().update_one(
+        {"key": key},
+        {
+            "$set": {
+                "content_digest": content_digest,
+                "fingerprint": fingerprint,
+                "model_version": model_version,
+                "class_map_version": class_map_version,
+                "options": effective_options(options),
+                "name_frames": name_frames,
+                "fps": fps,
+                "created_at": now,
+                "last_used": now,
+            },
+            "$setOnInsert": {"hits": 0},
+        },
+        upsert=True,
+    )
+    await evict(model_version, class_map_version)
+
+
+async def evict(model_version: str, class_map_version: str):
+    cutoff = datetime.utcnow() - timedelta(days=settings.RESULT_CACHE_MAX_AGE_DAYS)
+    await CachedResult.find(
+        {
+            "$or": [
+                {"model_version": {"$ne": model_version}},
+                {"class_map_version": {"$ne": class_map_version}},
+                {"created_at": {"$lt": cutoff}},
+            ]
+        }
+    ).delete()
+
+    excess = await CachedResult.count() - settings.RESULT_CACHE_MAX_ENTRIES
+    if excess > 0:
+        oldest = await CachedResult.find().sort(+CachedResult.last_used).limit(excess).to_list()
+        await CachedResult.find(In(CachedResult.id, [entry.id for entry in oldest])).delete()
@@ -0,0 +1,45 @@
+import json
+import os
+
+import numpy as np
+
+
+class ClassMap:
+    # results.json compiled into a class id -> person matrix, so presence for a
+    # whole batch is one scatter and one matrix product whatever the roster size
+
+    def __init__(self, names_data: list):
+        self.names = [entry["name"] for entry in names_data]
+        classes = [int(entry["class"]) for entry in names_data]
+        # matrix[c, p] is True when detecting class c means person p is present
+        self.matrix = np.zeros((max(classes, default=-1) + 1, len(classes)), bool)
+        self.matrix[classes, np.arange(len(classes))] = True
+
+    def presence(self, results) -> np.ndarray:
+        # (results, people) matrix of who was detected in each result
+        ids = [r.boxes.cls.cpu().numpy().astype(np.int64) for r in results]
+        frames = np.repeat(np.arange(len(ids)), [len(c) for c in ids])
+        classes = np.concatenate(ids) if ids else np.empty(0, np.int64)
+        known = (classes >= 0) & (classes < len(self.matrix))
+        detected = np.zeros((len(ids), len(self.matrix)), bool)
+        detected[frames[known], classes[known]] = True
+        return detected @ self.matrix
+
+    def totals(self, counts) -> dict:
+        # Entries sharing a name add up, as they did when counted one by one
+        durations = dict.fromkeys(self.names, 0)
+        for name, count in zip(self.names, counts.tolist()):
+            durations[name] += count
+        return durations
+
+
+loaded = {}
+
+
+def load_class_map(path: str) -> ClassMap:
+    # Parsed once and reused until the file changes
+    mtime = os.stat(path).st_mtime
+    if path not in loaded or loaded[path][0] != mtime:
+        with open(path, "r") as f:
+            loaded[path] = (mtime, ClassMap(json.load(f)))
+    return loaded[path][1]
@@ -2,6 +2,10 @@ from .settings import settings
 from ..models.user import User
 from ..models.response import VideoResponse, ImageResponse
 from ..models.api_key import ApiKey
+from ..models.job import VideoJob
+from ..models.cache import CachedResult
+from ..models.stream import VideoStream
+from ..models.rollup import AttendanceRollup
 from motor.motor_asyncio import AsyncIOMotorClient
 
 from beanie import init_beanie
@@ -13,4 +17,4 @@ async def startDB():
     client = AsyncIOMotorClient(settings.DATABASE_URL)
 
     # Init beanie with the Product document class
-    await init_beanie(database=client.db_name, document_models=[User,VideoResponse,ImageResponse,ApiKey])
\ No newline at end of file
+    await init_beanie(database=client.db_name, document_models=[User,VideoResponse,ImageResponse,ApiKey,VideoJob,CachedResult,VideoStream,AttendanceRollup])
\ No newline at end of file
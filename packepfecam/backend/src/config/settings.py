@@ -18,5 +18,137 @@ class Settings(BaseSettings):
     JWT_ALGORITHM: str = os.environ["JWT_ALGORITHM"]
     CLIENT_ORIGIN: str = os.environ["CLIENT_ORIGIN"]
 
+    # Logs are written to stdout as one JSON object per line
+    LOG_LEVEL: str = os.environ.get("LOG_LEVEL", "INFO")
+
+    # Number of decoded frames sent through the model in one forward pass
+    INFERENCE_BATCH_SIZE: int = os.environ.get("INFERENCE_BATCH_SIZE", 8)
+    # Frame sampling: run inference on every k-th frame, cap the analysed frames
+    # per second of video, or finish within a time budget in seconds (0 = off)
+    FRAME_STRIDE: int = os.environ.get("FRAME_STRIDE", 1)
+    MAX_ANALYSED_FPS: float = os.environ.get("MAX_ANALYSED_FPS", 0)
+    PROCESSING_TIME_BUDGET: float = os.environ.get("PROCESSING_TIME_BUDGET", 0)
+
+    # Long videos are split into up to VIDEO_SEGMENTS segments of at least
+    # MIN_SEGMENT_SECONDS, each decoded in its own inference process
+    VIDEO_SEGMENTS: int = os.environ.get("VIDEO_SEGMENTS", 1)
+    MIN_SEGMENT_SECONDS: float = os.environ.get("MIN_SEGMENT_SECONDS", 30)
+
+    # Single image requests arriving within IMAGE_BATCH_WINDOW_MS of each
+    # other share one forward pass of up to IMAGE_BATCH_SIZE images
+    IMAGE_BATCH_SIZE: int = os.environ.get("IMAGE_BATCH_SIZE", 16)
+    IMAGE_BATCH_WINDOW_MS: float = os.environ.get("IMAGE_BATCH_WINDOW_MS", 10)
+
+    # Per-request downloads (results JSON, annotated image) are kept in
+    # ARTIFACT_DIR, shared by every API worker, up to ARTIFACT_STORE_BYTES in
+    # total and for at most ARTIFACT_MAX_AGE seconds
+    ARTIFACT_DIR: str = os.environ.get("ARTIFACT_DIR", "/app/FILES/artifacts")
+    ARTIFACT_STORE_BYTES: int = os.environ.get("ARTIFACT_STORE_BYTES", 256 * 1024 * 1024)
+    ARTIFACT_MAX_AGE: float = os.environ.get("ARTIFACT_MAX_AGE", 3600)
+
+    # Bulk image uploads: most images per request (zip entries included) and
+    # largest image accepted from a zip archive
+    MAX_BULK_IMAGES: int = os.environ.get("MAX_BULK_IMAGES", 1000)
+    MAX_IMAGE_BYTES: int = os.environ.get("MAX_IMAGE_BYTES", 20 * 1024 * 1024)
+
+    # Background video jobs: concurrent videos and how many may wait in line
+    JOB_WORKERS: int = os.environ.get("JOB_WORKERS", 2)
+    JOB_QUEUE_SIZE: int = os.environ.get("JOB_QUEUE_SIZE", 16)
+    # Running jobs are marked alive every JOB_HEARTBEAT_SECONDS; ones silent for
+    # three heartbeats are queued again when the API starts
+    JOB_HEARTBEAT_SECONDS: float = os.environ.get("JOB_HEARTBEAT_SECONDS", 30)
+
+    # Worker processes that decode and run the model, each with its own copy,
+    # and how many calls may wait for a free process before we answer 503
+    INFERENCE_PROCESSES: int = os.environ.get("INFERENCE_PROCESSES", 2)
+    INFERENCE_QUEUE_SIZE: int = os.environ.get("INFERENCE_QUEUE_SIZE", 16)
+
+    # Uploads are written in chunks of this many bytes. Fast-start videos are
+    # queued for decoding once STREAM_DECODE_MIN_BYTES have arrived.
+    UPLOAD_CHUNK_SIZE: int = os.environ.get("UPLOAD_CHUNK_SIZE", 1024 * 1024)
+    STREAM_DECODE: bool = os.environ.get("STREAM_DECODE", True)
+    STREAM_DECODE_MIN_BYTES: int = os.environ.get("STREAM_DECODE_MIN_BYTES", 8 * 1024 * 1024)
+    UPLOAD_STALL_TIMEOUT: float = os.environ.get("UPLOAD_STALL_TIMEOUT", 60)
+
+    # Video results cached by content hash, model weights and class map
+    RESULT_CACHE_ENABLED: bool = os.environ.get("RESULT_CACHE_ENABLED", True)
+    RESULT_CACHE_MAX_ENTRIES: int = os.environ.get("RESULT_CACHE_MAX_ENTRIES", 1000)
+    RESULT_CACHE_MAX_AGE_DAYS: float = os.environ.get("RESULT_CACHE_MAX_AGE_DAYS", 30)
+
+    # Seconds a user profile used to enrich reports is reused without a query
+    PROFILE_CACHE_TTL: float = os.environ.get("PROFILE_CACHE_TTL", 60)
+
+    # API keys and token users are reused for AUTH_CACHE_TTL seconds without a
+    # query; unknown keys and users are remembered for AUTH_NEGATIVE_CACHE_TTL
+    AUTH_CACHE_TTL: float = os.environ.get("AUTH_CACHE_TTL", 60)
+    AUTH_NEGATIVE_CACHE_TTL: float = os.environ.get("AUTH_NEGATIVE_CACHE_TTL", 5)
+    AUTH_CACHE_MAX_ENTRIES: int = os.environ.get("AUTH_CACHE_MAX_ENTRIES", 10000)
+
+    # Threads hashing and checking passwords, and how many calls may wait for one
+    PASSWORD_HASH_THREADS: int = os.environ.get("PASSWORD_HASH_THREADS", 2)
+    PASSWORD_HASH_QUEUE_SIZE: int = os.environ.get("PASSWORD_HASH_QUEUE_SIZE", 64)
+
+    # Outbound mail: SMTP_CONNECTIONS senders each keep one connection open
+    # (closed after SMTP_IDLE_SECONDS unused) and send up to SMTP_BATCH_SIZE
+    # queued messages over it at a time. Failed sends are retried
+    # SMTP_MAX_RETRIES times, waiting SMTP_RETRY_SECONDS doubled each time.
+    SMTP_HOST: str = os.environ.get("SMTP_HOST", "smtp.sendgrid.net")
+    SMTP_PORT: int = os.environ.get("SMTP_PORT", 587)
+    SMTP_USERNAME: str = os.environ.get("SMTP_USERNAME", "apikey")
+    SMTP_PASSWORD: str = os.environ.get("SMTP_PASSWORD", "")
+    SMTP_STARTTLS: bool = os.environ.get("SMTP_STARTTLS", True)
+    SMTP_FROM_EMAIL: str = os.environ.get("SMTP_FROM_EMAIL", "oussema.benhassena@horizon-tech.tn")
+    SMTP_TIMEOUT: float = os.environ.get("SMTP_TIMEOUT", 30)
+    SMTP_CONNECTIONS: int = os.environ.get("SMTP_CONNECTIONS", 1)
+    SMTP_BATCH_SIZE: int = os.environ.get("SMTP_BATCH_SIZE", 20)
+    SMTP_IDLE_SECONDS: float = os.environ.get("SMTP_IDLE_SECONDS", 30)
+    SMTP_MAX_RETRIES: int = os.environ.get("SMTP_MAX_RETRIES", 5)
+    SMTP_RETRY_SECONDS: float = os.environ.get("SMTP_RETRY_SECONDS", 2)
+    MAIL_QUEUE_SIZE: int = os.environ.get("MAIL_QUEUE_SIZE", 1000)
+
+    # Documents per page of the admin listings, and the most a request may ask for
+    ADMIN_PAGE_SIZE: int = os.environ.get("ADMIN_PAGE_SIZE", 100)
+    ADMIN_MAX_PAGE_SIZE: int = os.environ.get("ADMIN_MAX_PAGE_SIZE", 1000)
+
+    # Tracking mode: the detector only runs on sampled keyframes and ByteTrack
+    # carries people in between, bridging misses of up to TRACK_MAX_LOST_SECONDS
+    TRACKING: bool = os.environ.get("TRACKING", False)
+    TRACK_HIGH_THRESH: float = os.environ.get("TRACK_HIGH_THRESH", 0.25)
+    TRACK_MAX_LOST_SECONDS: float = os.environ.get("TRACK_MAX_LOST_SECONDS", 2)
+
+    # Live streams: frames are shrunk to STREAM_FRAME_SIZE (longest side) and
+    # wait in a queue of STREAM_QUEUE_SIZE; when inference falls behind the
+    # oldest are dropped. Presence is reported per STREAM_WINDOW_SECONDS.
+    # MAX_STREAMS counts the streams of every API process.
+    MAX_STREAMS: int = os.environ.get("MAX_STREAMS", 4)
+    STREAM_QUEUE_SIZE: int = os.environ.get("STREAM_QUEUE_SIZE", 8)
+    STREAM_FRAME_SIZE: int = os.environ.get("STREAM_FRAME_SIZE", 640)
+    STREAM_WINDOW_SECONDS: float = os.environ.get("STREAM_WINDOW_SECONDS", 60)
+    # Gaps between analysed frames longer than this are not counted as presence
+    STREAM_MAX_GAP_SECONDS: float = os.environ.get("STREAM_MAX_GAP_SECONDS", 5)
+    STREAM_RECONNECT_SECONDS: float = os.environ.get("STREAM_RECONNECT_SECONDS", 5)
+    # Stream sources must be URLs with one of STREAM_SCHEMES, on one of
+    # STREAM_HOSTS if any are listed (comma-separated). Camera indexes and
+    # file paths on the server need STREAM_ALLOW_LOCAL.
+    STREAM_SCHEMES: str = os.environ.get("STREAM_SCHEMES", "rtsp,rtsps,http,https")
+    STREAM_HOSTS: str = os.environ.get("STREAM_HOSTS", "")
+    STREAM_ALLOW_LOCAL: bool = os.environ.get("STREAM_ALLOW_LOCAL", False)
+    # The API process running a stream renews its claim every
+    # STREAM_HEARTBEAT_SECONDS; another process takes over a stream after three
+    # missed heartbeats
+    STREAM_HEARTBEAT_SECONDS: float = os.environ.get("STREAM_HEARTBEAT_SECONDS", 10)
+
+    MODEL_PATH: str = os.environ.get("MODEL_PATH", "/app/src/routes/YOLO/best.pt")
+    # pytorch, onnx (ONNX Runtime), openvino or int8 (quantized ONNX Runtime).
+    # Exports are made from MODEL_PATH; int8 is calibrated on CALIBRATION_FRAMES
+    # frames from CALIBRATION_VIDEOS. EXPORT_OPSET 0 keeps ultralytics' default.
+    INFERENCE_BACKEND: str = os.environ.get("INFERENCE_BACKEND", "pytorch")
+    EXPORT_OPSET: int = os.environ.get("EXPORT_OPSET", 0)
+    CALIBRATION_VIDEOS: str = os.environ.get("CALIBRATION_VIDEOS", "/app/uploads/*.mp4")
+    CALIBRATION_FRAMES: int = os.environ.get("CALIBRATION_FRAMES", 64)
+    # Dummy batches run by each inference process before the API reports ready
+    WARMUP_RUNS: int = os.environ.get("WARMUP_RUNS", 1)
+    WARMUP_IMAGE_SIZE: int = os.environ.get("WARMUP_IMAGE_SIZE", 640)
+
 
 settings = Settings()
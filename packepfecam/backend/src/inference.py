@@ -0,0 +1,248 @@
+import math
+import os
+import time
+
+import cv2
+import numpy as np
+import torch
+
+from .config.settings import settings
+from . import registry, ingest, metrics, logs
+from .tracking import PresenceTracker, TRACK_LOW_THRESH
+
+# Everything in this module runs inside the inference worker processes, see workers.py
+
+model = None
+progress = None
+batch_size = max(1, settings.INFERENCE_BATCH_SIZE)
+
+
+def init_worker(shared_progress, threads: int):
+    global model, progress
+    logs.setup()
+    metrics.buffered = True
+    # Split the cores between worker processes instead of oversubscribing them
+    torch.set_num_threads(threads)
+    model = registry.get_model()
+    # Usually loaded in the forkserver, whose metrics never reach the API process
+    for phase, seconds in registry.startup_seconds.items():
+        metrics.model(phase, seconds)
+    registry.warm_up(model, batch_size)
+    progress = shared_progress
+
+
+def ready(barrier):
+    # Holding every process at the barrier makes sure each one ran init_worker
+    barrier.wait(timeout=600)
+    return os.getpid()
+
+
+def report(progress_key, fraction: float):
+    if progress_key and progress is not None:
+        progress[progress_key] = fraction
+
+
+def count_presence(results, class_map, counts: np.ndarray, weights: list):
+    # One result per frame, so batched and per-frame inference count the same.
+    # Each sampled frame is weighted by the number of video frames it stands for.
+    counts += np.asarray(weights) @ class_map.presence(results)
+
+
+def scaled_shape(height: int, width: int, size: int):
+    # The shape ultralytics' LetterBox resizes a frame to before padding it.
+    # Frames shrunk to it here are left alone by the predictor, so detections
+    # are the same as when the full size frame is passed in.
+    r = min(size / height, size / width, 1.0)
+    return int(round(height * r)), int(round(width * r))
+
+
+def pick_stride(fps: float, stride: int = None, max_fps: float = None) -> int:
+    stride = max(1, int(stride or settings.FRAME_STRIDE))
+    max_fps = max_fps or settings.MAX_ANALYSED_FPS
+    if max_fps and fps:
+        stride = max(stride, math.ceil(fps / max_fps))
+    return stride
+
+
+def budget_stride(base_stride: int, decode_cost: float, inference_cost: float, frames_left: int, seconds_left: float) -> int:
+    # frames_left * decode_cost + (frames_left / stride) * inference_cost <= seconds_left
+    spare = seconds_left - frames_left * decode_cost
+    if spare <= 0:
+        return max(base_stride, frames_left)
+    return max(base_stride, math.ceil(frames_left * inference_cost / spare))
+
+
+def probe_video(video_path: str):
+    cap = cv2.VideoCapture(video_path)
+    try:
+        return cap.get(cv2.CAP_PROP_FPS), int(cap.get(cv2.CAP_PROP_FRAME_COUNT))
+    finally:
+        cap.release()
+
+
+def split_segments(total_frames: int, segments: int, stride: int, min_frames: int) -> list:
+    # (start, end) frame ranges. Segments start on a multiple of the stride so
+    # they sample exactly the frames a sequential run would.
+    segments = max(1, min(segments, total_frames // max(1, min_frames)))
+    step = math.ceil(total_frames / segments / stride) * stride
+    return [(start, min(start + step, total_frames)) for start in range(0, total_frames, step)] or [(0, total_frames)]
+
+
+def analyse_video(video_path: str, class_map, stride: int = None, max_fps: float = None, time_budget: float = None, tracking: bool = None, start: int = 0, end: int = None, timings: dict = None, progress_key: str = None):
+    # Returns the number of frames each person was seen in, and the video fps.
+    # start and end limit it to one segment of the video. A timings dict is
+    # filled with the seconds spent per stage and the frames decoded/analysed.
+    counts = np.zeros(len(class_map.names), np.int64)
+
+    cap = cv2.VideoCapture(video_path)
+
+    if not cap.isOpened():
+        raise Exception("Failed to open video file")
+
+    # The upload may still be arriving when streaming decode started the job
+    waiter = ingest.UploadWaiter(video_path) if os.path.exists(ingest.uploading_marker(video_path)) else None
+
+    try:
+        fps = cap.get(cv2.CAP_PROP_FPS)
+        total_frames = int(cap.get(cv2.CAP_PROP_FRAME_COUNT))
+        end = total_frames if end is None else min(end, total_frames)
+        if start:
+            cap.set(cv2.CAP_PROP_POS_FRAMES, start)
+
+        base_stride = pick_stride(fps, stride, max_fps)
+        stride = base_stride
+        time_budget = time_budget or settings.PROCESSING_TIME_BUDGET
+        deadline = time.monotonic() + time_budget if time_budget else None
+        stage = {"decode": 0.0, "inference": 0.0, "counting": 0.0}
+        decoded = inferred = 0
+
+        # In tracking mode the sampled frames are detector keyframes and
+        # durations come from the tracks rather than from the detections alone
+        tracking = settings.TRACKING if tracking is None else tracking
+        tracker = PresenceTracker(class_map, fps, base_stride) if tracking else None
+
+        # Sampled frames are decoded into one reused buffer and shrunk straight
+        # into per-batch slots, so the loop allocates no arrays per frame
+        height, width = int(cap.get(cv2.CAP_PROP_FRAME_HEIGHT)), int(cap.get(cv2.CAP_PROP_FRAME_WIDTH))
+        shape = scaled_shape(height, width, registry.input_size(model))
+        shrink = shape != (height, width)
+        slots = [np.empty((*shape, 3), np.uint8) for _ in range(batch_size)]
+        decoded_frame = None
+
+        reported = {"decode": 0.0, "frames": 0}
+
+        def infer(batch, weights):
+            nonlocal inferred
+            started = time.monotonic()
+            results = model(batch, conf=TRACK_LOW_THRESH, verbose=False) if tracker else model(batch, verbose=False)
+            counted = time.monotonic()
+            if tracker:
+                for r, weight in zip(results, weights):
+                    tracker.update(r, weight)
+            else:
+                count_presence(results, class_map, counts, weights)
+            finished = time.monotonic()
+            stage["inference"] += counted - started
+            stage["counting"] += finished - counted
+            inferred += len(batch)
+
+            # Once per batch, so the metrics cost nothing per frame
+            metrics.stage("decode", stage["decode"] - reported["decode"])
+            metrics.stage("inference_batch", counted - started)
+            metrics.stage("inference_frame", (counted - started) / len(batch))
+            metrics.stage("counting", finished - counted)
+            metrics.frames("decoded", decoded - reported["frames"])
+            metrics.frames("analysed", len(batch))
+            reported.update(decode=stage["decode"], frames=decoded)
+
+        batch, weights = [], []
+        next_sample = start
+        for index in range(start, end):
+            if waiter and not waiter.wait(index):
+                waiter = None
+            started = time.monotonic()
+            ret = cap.grab()
+            if not ret and waiter:
+                # The demuxer read past the end of the partial file; reopen at this frame
+                cap.release()
+                cap = cv2.VideoCapture(video_path)
+                cap.set(cv2.CAP_PROP_POS_FRAMES, index)
+                ret = cap.grab()
+            # Frames that are skipped are never converted to BGR or copied out
+            if ret and index >= next_sample:
+                if shrink:
+                    ret, decoded_frame = cap.retrieve(decoded_frame)
+                    frame = cv2.resize(decoded_frame, shape[::-1], dst=slots[len(batch)], interpolation=cv2.INTER_LINEAR) if ret else None
+                else:
+                    ret, frame = cap.retrieve(slots[len(batch)])
+            stage["decode"] += time.monotonic() - started
+            decoded += 1
+            if not ret:
+                break
+            if index < next_sample:
+                continue
+
+            batch.append(frame)
+            weights.append(min(stride, total_frames - index))
+            next_sample = index + stride
+            if len(batch) == batch_size:
+                infer(batch, weights)
+                batch, weights = [], []
+                report(progress_key, (index + 1 - start) / (end - start))
+
+                # Re-estimate the stride needed to finish within the time budget
+                if deadline:
+                    stride = budget_stride(
+                        base_stride,
+                        stage["decode"] / decoded,
+                        (stage["inference"] + stage["counting"]) / inferred,
+                        end - index - 1,
+                        deadline - time.monotonic(),
+                    )
+
+        # Flush the frames left over from the last incomplete batch
+        if batch:
+            infer(batch, weights)
+        if tracker:
+            counts = tracker.counts()
+        if timings is not None:
+            timings.update(stage, frames=decoded, analysed=inferred)
+    finally:
+        cap.release()
+
+    return class_map.totals(counts), fps
+
+
+def detect_presence(frames: list, class_map) -> np.ndarray:
+    # (frames, people) presence for one batch of live stream frames, see streams.py
+    started = time.monotonic()
+    results = model(frames, verbose=False)
+    metrics.stage("stream_inference_batch", time.monotonic() - started)
+    metrics.frames("stream_analysed", len(frames))
+    return class_map.presence(results)
+
+
+def analyse_images(contents: list, class_map, render: list = None) -> list:
+    # (Present/Absent per person, annotated JPEG) for each image, from one
+    # forward pass. Only the images flagged in render are drawn and encoded;
+    # images that cannot be decoded give (None, None).
+    images = [cv2.imdecode(np.frombuffer(content, np.uint8), cv2.IMREAD_COLOR) for content in contents]
+    decoded = [img for img in images if img is not None]
+    started = time.monotonic()
+    results = model(decoded, verbose=False) if decoded else []
+    metrics.stage("image_inference_batch", time.monotonic() - started)
+    seen = iter(zip(results, class_map.presence(results)))
+
+    analysed = []
+    for i, img in enumerate(images):
+        if img is None:
+            analysed.append((None, None))
+            continue
+        r, present = next(seen)
+        name_durations = {name: "Present" if count else "Absent" for name, count in class_map.totals(present).items()}
+        image = None
+        if render and render[i]:
+            # plot() draws on a BGR copy, which is what imencode expects
+            image = cv2.imencode(".jpg", r.plot())[1].tobytes()
+        analysed.append((name_durations, image))
+    return analysed
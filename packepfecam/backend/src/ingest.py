@@ -0,0 +1,252 @@
+import hashlib
+import os
+import struct
+import time
+
+import aiofiles
+from fastapi import HTTPException, Request
+from multipart.multipart import MultipartParser, parse_options_header
+
+from .config.settings import settings
+
+
+# Frames decoded ahead of the one being read (B-frame reordering); the decoder
+# waits until the samples for these frames are on disk too
+REORDER_MARGIN = 8
+CONTAINERS = {b"moov", b"trak", b"mdia", b"minf", b"stbl"}
+
+
+def uploading_marker(video_path: str) -> str:
+    return video_path + ".uploading"
+
+
+def aborted_marker(video_path: str) -> str:
+    return video_path + ".aborted"
+
+
+def discard(video_path: str):
+    # Removes a partial upload and its markers
+    for path in (video_path, uploading_marker(video_path), aborted_marker(video_path)):
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            pass
+
+
+def iter_boxes(data: bytes, start: int = 0, end: int = None):
+    # Yields (type, payload start, box end) for the MP4 boxes in data[start:end]
+    end = len(data) if end is None else end
+    while start + 8 <= end:
+        size, kind = struct.unpack(">I4s", data[start : start + 8])
+        header = 8
+        if size == 1:
+            if start + 16 > end:
+                return
+            size = struct.unpack(">Q", data[start + 8 : start + 16])[0]
+            header = 16
+        elif size == 0:
+            size = end - start
+        if size < header:
+            return
+        yield kind, start + header, start + size
+        start += size
+
+
+def find_moov(head: bytes):
+    # Returns the moov box if it is complete and comes before mdat (a
+    # "fast start" file), False if mdat comes first, None if undecided yet
+    for kind, payload, box_end in iter_boxes(head):
+        if kind == b"mdat":
+            return False
+        if kind == b"moov":
+            return head[payload - 8 : box_end] if box_end <= len(head) else None
+    return None
+
+
+def video_sample_ends(moov: bytes) -> list:
+    # End offset in the file of each video sample, as a running maximum so
+    # ends[i] is the number of bytes needed to decode samples 0..i
+    tables = {}
+
+    def walk(start, end, track):
+        for kind, payload, box_end in iter_boxes(moov, start, end):
+            if kind == b"trak":
+                found = {}
+                walk(payload, box_end, found)
+                if found.get("handler") == b"vide":
+                    tables.update(found)
+            elif kind in CONTAINERS:
+                walk(payload, box_end, track)
+            elif kind == b"hdlr":
+                track["handler"] = moov[payload + 8 : payload + 12]
+            elif kind in (b"stsz", b"stco", b"co64", b"stsc"):
+                track[kind] = moov[payload:box_end]
+
+    walk(0, len(moov), {})
+    if not all(k in tables for k in (b"stsz", b"stsc")) or not (b"stco" in tables or b"co64" in tables):
+        return []
+
+    stsz = tables[b"stsz"]
+    sample_size, count = struct.unpack(">II", stsz[4:12])
+    sizes = [sample_size] * count if sample_size else list(struct.unpack(f">{count}I", stsz[12 : 12 + 4 * count]))
+
+    if b"co64" in tables:
+        n = struct.unpack(">I", tables[b"co64"][4:8])[0]
+        offsets = struct.unpack(f">{n}Q", tables[b"co64"][8 : 8 + 8 * n])
+    else:
+        n = struct.unpack(">I", tables[b"stco"][4:8])[0]
+        offsets = struct.unpack(f">{n}I", tables[b"stco"][8 : 8 + 4 * n])
+
+    stsc = tables[b"stsc"]
+    runs = [struct.unpack(">III", stsc[8 + 12 * i : 20 + 12 * i]) for i in range(struct.unpack(">I", stsc[4:8])[0])]
+
+    ends, sample, furthest = [], 0, 0
+    for i, (first_chunk, per_chunk, _) in enumerate(runs):
+        last_chunk = runs[i + 1][0] - 1 if i + 1 < len(runs) else len(offsets)
+        for chunk in range(first_chunk - 1, last_chunk):
+            position = offsets[chunk]
+            for _ in range(per_chunk):
+                if sample >= count:
+                    return ends
+                position += sizes[sample]
+                furthest = max(furthest, position)
+                ends.append(furthest)
+                sample += 1
+    return ends
+
+
+class UploadWaiter:
+    # Lets the decoder (in an inference process) trail a video that is still being received
+
+    def __init__(self, video_path: str):
+        self.video_path = video_path
+        with open(video_path, "rb") as f:
+            moov = find_moov(f.read(settings.STREAM_DECODE_MIN_BYTES))
+        self.sample_ends = video_sample_ends(moov) if moov else []
+
+    def wait(self, frame_index: int) -> bool:
+        # Blocks until the frame can be decoded; False once the upload has finished
+        needed = 0
+        if self.sample_ends:
+            needed = self.sample_ends[min(frame_index + REORDER_MARGIN, len(self.sample_ends) - 1)]
+        last_size, last_change = -1, time.monotonic()
+        while os.path.exists(uploading_marker(self.video_path)):
+            size = os.path.getsize(self.video_path)
+            if needed and size >= needed:
+                return True
+            if size != last_size:
+                last_size, last_change = size, time.monotonic()
+            elif time.monotonic() - last_change > settings.UPLOAD_STALL_TIMEOUT:
+                raise Exception("Upload stalled")
+            time.sleep(0.05)
+        if os.path.exists(aborted_marker(self.video_path)):
+            raise Exception("Upload was aborted")
+        return False
+
+
+async def receive_video(request: Request, path_for, on_decodable=None, field: str = "video_file"):
+    # Streams one multipart file field straight to its final path with large
+    # buffered writes, skipping the temporary file UploadFile would spool to.
+    # on_decodable(fingerprint) is awaited as soon as a fast-start video can be
+    # decoded. Returns the path, the SHA-256 of the content and the fingerprint
+    # (SHA-256 of the moov box, None if the video is not fast-start).
+    _, params = parse_options_header(request.headers.get("Content-Type", ""))
+    if b"boundary" not in params:
+        raise HTTPException(status_code=400, detail="Expected a multipart/form-data upload")
+
+    # The parser callbacks are synchronous, so they only record events that
+    # are then handled (and awaited) after each chunk
+    events = []
+    part = {}
+
+    def on_part_begin():
+        part.update(field=b"", value=b"", headers={})
+
+    def on_header_field(data, start, end):
+        part["field"] += data[start:end]
+
+    def on_header_value(data, start, end):
+        part["value"] += data[start:end]
+
+    def on_header_end():
+        part["headers"][part["field"].lower()] = part["value"]
+        part.update(field=b"", value=b"")
+
+    callbacks = {
+        "on_part_begin": on_part_begin,
+        "on_header_field": on_header_field,
+        "on_header_value": on_header_value,
+        "on_header_end": on_header_end,
+        "on_headers_finished": lambda: events.append(("headers", part["headers"])),
+        "on_part_data": lambda data, start, end: events.append(("data", data[start:end])),
+        "on_part_end": lambda: events.append(("end", None)),
+    }
+    parser = MultipartParser(params[b"boundary"], callbacks)
+
+    video_path = None
+    writing = False
+    buffer = bytearray()
+    head = bytearray()
+    moov = None
+    fingerprint = None
+    content = hashlib.sha256()
+    received = 0
+    streamable = on_decodable is not None
+    out = None
+
+    async def flush():
+        if buffer:
+            await out.write(bytes(buffer))
+            await out.flush()
+            buffer.clear()
+
+    try:
+        async for chunk in request.stream():
+            parser.write(chunk)
+            for event, data in events:
+                if event == "headers" and video_path is None:
+                    _, options = parse_options_header(data.get(b"content-disposition", b""))
+                    if options.get(b"name", b"").decode() == field and b"filename" in options:
+                        video_path = path_for(os.path.basename(options[b"filename"].decode()))
+                        open(uploading_marker(video_path), "w").close()
+                        out = await aiofiles.open(video_path, "wb")
+                        writing = True
+                elif event == "data" and writing:
+                    buffer.extend(data)
+                    content.update(data)
+                    received += len(data)
+                    if len(buffer) >= settings.UPLOAD_CHUNK_SIZE:
+                        await flush()
+                    if moov is None:
+                        head.extend(data)
+                        moov = find_moov(head)
+                        if moov is None and len(head) >= settings.STREAM_DECODE_MIN_BYTES:
+                            moov = False
+                        if moov is not None:
+                            fingerprint = hashlib.sha256(moov).hexdigest() if moov else None
+                            head = None
+                    if streamable and moov is False:
+                        streamable = False
+                    elif streamable and moov and received >= settings.STREAM_DECODE_MIN_BYTES:
+                        streamable = False
+                        await flush()
+                        await on_decodable(fingerprint)
+                elif event == "end" and writing:
+                    writing = False
+            events.clear()
+        parser.finalize()
+
+        if video_path is None:
+            raise HTTPException(status_code=422, detail=f"Missing file field '{field}'")
+        await flush()
+    except BaseException:
+        if video_path:
+            open(aborted_marker(video_path), "w").close()
+        raise
+    finally:
+        if out:
+            await out.close()
+        if video_path and os.path.exists(uploading_marker(video_path)):
+            os.remove(uploading_marker(video_path))
+
+    return video_path, content.hexdigest(), fingerprint
@@ -0,0 +1,119 @@
+import asyncio
+import logging
+from datetime import datetime, timedelta
+
+from .config.settings import settings
+from .models.job import VideoJob
+from . import metrics
+
+logger = logging.getLogger(__name__)
+
+queue: asyncio.Queue = None
+workers = []
+
+
+class QueueFull(Exception):
+    pass
+
+
+async def _run(job_id, handler):
+    # Claim the job atomically so a job is never run twice, even when several
+    # uvicorn workers re-enqueue the same queued jobs at startup
+    claimed = await VideoJob.get_motor_collection().update_one(
+        {"_id": job_id, "status": "queued"}, {"$set": {"status": "running", "heartbeat_at": datetime.utcnow()}}
+    )
+    if not claimed.modified_count:
+        return
+
+    job = await VideoJob.get(job_id)
+    metrics.stage("job_queue_wait", (datetime.utcnow() - job.created_at).total_seconds())
+    reported = 0
+
+    async def progress(fraction: float):
+        nonlocal reported
+        percent = round(fraction * 100, 1)
+        if percent - reported >= 1:
+            reported = percent
+            await job.set({VideoJob.progress: percent})
+
+    beat = asyncio.create_task(_heartbeat(job))
+    try:
+        results = await handler(job, progress)
+        await job.set(
+            {
+                VideoJob.status: "done",
+                VideoJob.progress: 100,
+                VideoJob.results: results,
+                VideoJob.finished_at: datetime.utcnow(),
+            }
+        )
+    except asyncio.CancelledError:
+        # Stopped by a shutdown or reload: hand the job back for the next start
+        logger.warning("Job interrupted, queued again", extra={"job_id": str(job_id)})
+        await VideoJob.get_motor_collection().update_one(
+            {"_id": job_id, "status": "running"}, {"$set": {"status": "queued", "progress": 0}}
+        )
+        raise
+    except Exception as e:
+        logger.error("Job failed", extra={"job_id": str(job_id), "error": str(e)})
+        await job.set(
+            {
+                VideoJob.status: "failed",
+                VideoJob.error: str(e),
+                VideoJob.finished_at: datetime.utcnow(),
+            }
+        )
+    finally:
+        beat.cancel()
+
+
+async def _heartbeat(job: VideoJob):
+    while True:
+        await asyncio.sleep(settings.JOB_HEARTBEAT_SECONDS)
+        await job.set({VideoJob.heartbeat_at: datetime.utcnow()})
+
+
+async def _worker(handler):
+    while True:
+        job_id = await queue.get()
+        try:
+            await _run(job_id, handler)
+        finally:
+            queue.task_done()
+
+
+def submit(job: VideoJob):
+    try:
+        queue.put_nowait(job.id)
+    except asyncio.QueueFull:
+        raise QueueFull("Too many videos are waiting to be processed")
+
+
+async def start_workers(handler):
+    global queue
+    queue = asyncio.Queue(maxsize=max(1, settings.JOB_QUEUE_SIZE))
+    metrics.QUEUE_DEPTH.labels("jobs").set_function(queue.qsize)
+    for _ in range(max(1, settings.JOB_WORKERS)):
+        workers.append(asyncio.create_task(_worker(handler)))
+
+    # Jobs left running by a process that died without handing them back
+    stale = datetime.utcnow() - timedelta(seconds=3 * settings.JOB_HEARTBEAT_SECONDS)
+    await VideoJob.get_motor_collection().update_many(
+        {"status": "running", "$or": [{"heartbeat_at": {"$lt": stale}}, {"heartbeat_at": None}]},
+        {"$set": {"status": "queued", "progress": 0}},
+    )
+
+    # Pick up jobs that were accepted but not started before the last shutdown
+    pending = await VideoJob.find(VideoJob.status == "queued").to_list()
+    for job in pending:
+        try:
+            submit(job)
+        except QueueFull:
+            await job.set({VideoJob.status: "failed", VideoJob.error: "Job queue was full after restart"})
+
+
+async def stop_workers():
+    for worker in workers:
+        worker.cancel()
+    await asyncio.gather(*workers, return_exceptions=True)
+    workers.clear()
@@ -0,0 +1,85 @@
+import base64
+from datetime import datetime
+
+import orjson
+from bson import ObjectId
+from bson.errors import InvalidId
+from fastapi import HTTPException
+from fastapi.responses import Response, StreamingResponse
+
+from .config.settings import settings
+
+# Keyset-paginated admin listings read straight from the Mongo cursor: newest
+# first by (date field, _id) or by _id alone, projected to the requested
+# fields and serialized with orjson, so memory is bounded by one page (or one
+# cursor batch when streamed as NDJSON) whatever the size of the collection.
+
+
+def encode_cursor(doc: dict, date_field: str = None) -> str:
+    key = [doc[date_field].isoformat() if date_field and doc.get(date_field) else None, str(doc["_id"])]
+    return base64.urlsafe_b64encode(orjson.dumps(key)).decode()
+
+
+def decode_cursor(cursor: str):
+    try:
+        date, id = orjson.loads(base64.urlsafe_b64decode(cursor.encode()))
+        return (datetime.fromisoformat(date) if date else None), ObjectId(id)
+    except (ValueError, TypeError, InvalidId):
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+
+
+def projection(fields: str, allowed: set, date_field: str = None):
+    # Every allowed field when none are asked for; _id and the date field are
+    # always included as the cursor is built from them
+    requested = set(allowed) if not fields else {f.strip() for f in fields.split(",") if f.strip()}
+    unknown = requested - allowed
+    if unknown:
+        raise HTTPException(status_code=400, detail=f"Unknown fields: {', '.join(sorted(unknown))}")
+    return {field: 1 for field in requested | ({date_field} if date_field else set())}
+
+
+def build_query(filter: dict, date_field: str = None, since: datetime = None, until: datetime = None, cursor: str = None, sort_by_date: bool = True) -> dict:
+    clauses = [filter] if filter else []
+    if date_field and (since or until):
+        clauses.append({date_field: {k: v for k, v in (("$gte", since), ("$lt", until)) if v}})
+    if cursor:
+        date, id = decode_cursor(cursor)
+        if sort_by_date:
+            # Strictly after the last document in (date, _id) descending order
+            clauses.append({"$or": [{date_field: {"$lt": date}}, {date_field: date, "_id": {"$lt": id}}]})
+        else:
+            clauses.append({"_id": {"$lt": id}})
+    return {"$and": clauses} if len(clauses) > 1 else (clauses[0] if clauses else {})
+
+
+def dumps(value) -> bytes:
+    return orjson.dumps(value, default=str)
+
+
+async def respond(collection, key: str, filter: dict, allowed: set, date_field: str, since: datetime = None, until: datetime = None, fields: str = None, cursor: str = None, limit: int = None, format: str = "json", sort_by_date: bool = True):
+    # One page as {key: [...], "next_cursor": ...}, or with format=ndjson every
+    # matching document, one per line, as the cursor yields them. since and
+    # until filter on date_field; documents where it may be missing are paged
+    # by _id alone (sort_by_date=False).
+    if format not in ("json", "ndjson"):
+        raise HTTPException(status_code=400, detail="format must be json or ndjson")
+    sort = ([(date_field, -1)] if sort_by_date else []) + [("_id", -1)]
+    find = collection.find(
+        build_query(filter, date_field, since, until, cursor, sort_by_date),
+        projection(fields, allowed, date_field),
+        sort=sort,
+        batch_size=settings.ADMIN_PAGE_SIZE,
+    )
+
+    if format == "ndjson":
+        async def lines():
+            async for doc in find:
+                yield dumps(doc) + b"\n"
+
+        return StreamingResponse(lines(), media_type="application/x-ndjson")
+
+    limit = max(1, min(limit or settings.ADMIN_PAGE_SIZE, settings.ADMIN_MAX_PAGE_SIZE))
+    # One extra document tells whether there is a next page
+    docs = await find.limit(limit + 1).to_list(length=limit + 1)
+    next_cursor = encode_cursor(docs[limit - 1], date_field if sort_by_date else None) if len(docs) > limit else None
+    return Response(dumps({key: docs[:limit], "next_cursor": next_cursor}), media_type="application/json")
@@ -0,0 +1,172 @@
+import asyncio
+import logging
+import smtplib
+import time
+from concurrent.futures import ThreadPoolExecutor
+from email.message import Message
+
+from .config.settings import settings
+from . import metrics
+
+logger = logging.getLogger(__name__)
+
+# Outbound mail is queued and sent in the background, so requests never wait
+# for the relay. smtplib blocks, so each sender runs it on its own thread
+# over a connection it keeps open between batches.
+
+queue: asyncio.Queue = None
+senders = []
+retries = set()
+executor: ThreadPoolExecutor = None
+
+
+class MailQueueFull(Exception):
+    pass
+
+
+def permanent(error: Exception) -> bool:
+    # 5xx replies will fail the same way again; anything else is worth a retry
+    if isinstance(error, smtplib.SMTPRecipientsRefused):
+        return all(code >= 500 for code, _ in error.recipients.values())
+    return isinstance(error, smtplib.SMTPResponseException) and error.smtp_code >= 500
+
+
+class Connection:
+    # One SMTP session reused for every batch of a sender; only touched from
+    # the sender's executor calls, which never overlap
+
+    def __init__(self):
+        self.smtp = None
+
+    def open(self):
+        smtp = smtplib.SMTP(settings.SMTP_HOST, settings.SMTP_PORT, timeout=settings.SMTP_TIMEOUT)
+        try:
+            if settings.SMTP_STARTTLS:
+                smtp.starttls()
+            if settings.SMTP_USERNAME:
+                smtp.login(settings.SMTP_USERNAME, settings.SMTP_PASSWORD)
+        except Exception:
+            smtp.close()
+            raise
+        self.smtp = smtp
+
+    def close(self):
+        if self.smtp:
+            try:
+                self.smtp.quit()
+            except (smtplib.SMTPException, OSError):
+                self.smtp.close()
+            self.smtp = None
+
+    def send(self, messages: list) -> tuple:
+        # (messages not sent because the connection failed, the error);
+        # messages the relay refuses for good are dropped
+        done = 0
+        try:
+            if self.smtp is None:
+                self.open()
+            for message in messages:
+                try:
+                    self.smtp.send_message(message)
+                    metrics.EMAILS.labels("sent").inc()
+                except (smtplib.SMTPRecipientsRefused, smtplib.SMTPSenderRefused, smtplib.SMTPDataError) as e:
+                    if not permanent(e):
+                        raise
+                    logger.error("Email refused", extra={"to": message["To"], "error": str(e)})
+                    metrics.EMAILS.labels("refused").inc()
+                done += 1
+        except (smtplib.SMTPException, OSError) as e:
+            self.close()
+            return messages[done:], e
+        return [], None
+
+
+async def _retry(message: Message, attempt: int):
+    await asyncio.sleep(min(settings.SMTP_RETRY_SECONDS * 2 ** (attempt - 1), 300))
+    try:
+        queue.put_nowait((message, attempt))
+    except asyncio.QueueFull:
+        logger.error("Email dropped, queue full", extra={"to": message["To"]})
+        metrics.EMAILS.labels("dropped").inc()
+
+
+def schedule_retry(message: Message, attempt: int, error: Exception):
+    if attempt > settings.SMTP_MAX_RETRIES:
+        logger.error("Email dropped after retries", extra={"to": message["To"], "error": str(error)})
+        metrics.EMAILS.labels("dropped").inc()
+        return
+    metrics.EMAILS.labels("retried").inc()
+    task = asyncio.create_task(_retry(message, attempt))
+    retries.add(task)
+    task.add_done_callback(retries.discard)
+
+
+async def _sender():
+    loop = asyncio.get_running_loop()
+    connection = Connection()
+    try:
+        while True:
+            try:
+                batch = [await asyncio.wait_for(queue.get(), settings.SMTP_IDLE_SECONDS)]
+            except asyncio.TimeoutError:
+                await loop.run_in_executor(executor, connection.close)
+                continue
+            while len(batch) < max(1, settings.SMTP_BATCH_SIZE) and not queue.empty():
+                batch.append(queue.get_nowait())
+
+            started = time.monotonic()
+            try:
+                unsent, error = await loop.run_in_executor(executor, connection.send, [message for message, _ in batch])
+            finally:
+                for _ in batch:
+                    queue.task_done()
+            metrics.stage("mail_batch_send", time.monotonic() - started)
+
+            if error:
+                logger.warning("Email send failed, retrying", extra={"unsent": len(unsent), "error": str(error)})
+                attempts = {id(message): attempt for message, attempt in batch}
+                for message in unsent:
+                    schedule_retry(message, attempts[id(message)] + 1, error)
+    finally:
+        executor.submit(connection.close)
+
+
+def check_room():
+    # Lets a request refuse up front, before it commits anything a mail depends on
+    if queue.full():
+        raise MailQueueFull("Too many emails are waiting to be sent")
+
+
+def submit(message: Message, defer: bool = False):
+    # Raises MailQueueFull instead of waiting when the relay is far behind;
+    # with defer the message is tried again later, as after a failed send
+    try:
+        queue.put_nowait((message, 0))
+    except asyncio.QueueFull:
+        if not defer:
+            raise MailQueueFull("Too many emails are waiting to be sent")
+        logger.warning("Mail queue full, email deferred", extra={"to": message["To"]})
+        schedule_retry(message, 1, MailQueueFull("Mail queue was full"))
+
+
+async def start_senders():
+    global queue, executor
+    queue = asyncio.Queue(maxsize=max(1, settings.MAIL_QUEUE_SIZE))
+    metrics.QUEUE_DEPTH.labels("mail").set_function(queue.qsize)
+    executor = ThreadPoolExecutor(max_workers=max(1, settings.SMTP_CONNECTIONS), thread_name_prefix="smtp")
+    for _ in range(max(1, settings.SMTP_CONNECTIONS)):
+        senders.append(asyncio.create_task(_sender()))
+
+
+async def stop_senders(timeout: float = 10):
+    # Give queued mail a moment to go out before the senders are stopped
+    try:
+        await asyncio.wait_for(queue.join(), timeout)
+    except asyncio.TimeoutError:
+        logger.warning("Stopping with unsent emails", extra={"unsent": queue.qsize()})
+    for task in [*senders, *retries]:
+        task.cancel()
+    await asyncio.gather(*senders, *retries, return_exceptions=True)
+    senders.clear()
+    # Lets the senders quit their connections without blocking the event loop
+    await asyncio.get_running_loop().run_in_executor(None, executor.shutdown)
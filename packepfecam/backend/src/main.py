@@ -1,11 +1,20 @@
-from fastapi import FastAPI
+import asyncio
+import time
+from fastapi import FastAPI, HTTPException, Request, Response
 from fastapi.middleware.cors import CORSMiddleware
+from prometheus_client import CONTENT_TYPE_LATEST, generate_latest
 
 from src.config.settings import settings
 from src.config.database import startDB
+from src import jobs, workers, streams, metrics, logs, mailer
 from src.routes import auth, user, presence, image_presence, admin
 from fastapi.staticfiles import StaticFiles
 
+logs.setup()
+
+# Startup work left running in the background; the loop only keeps weak references to tasks
+background = set()
+
 app = FastAPI(title="Video Presence API", description="API for Video Presence", version="2.0.0")
 app.mount("/app/uploads", StaticFiles(directory="/app/uploads"), name="uploads")
 
@@ -22,12 +31,40 @@ app.add_middleware(
 )
 
 
+@app.middleware("http")
+async def observe_requests(request: Request, call_next):
+    started = time.monotonic()
+    response = await call_next(request)
+    # The route template keeps ids out of the labels; unmatched paths share one
+    route = request.scope.get("route")
+    metrics.REQUEST_SECONDS.labels(request.method, getattr(route, "path", "unmatched"), response.status_code).observe(time.monotonic() - started)
+    return response
+
+
 @app.on_event("startup")
 async def start_dependencies():
     await startDB()
+    await mailer.start_senders()
+    workers.start_pool()
+    task = asyncio.create_task(workers.warm_up())
+    background.add(task)
+    task.add_done_callback(background.discard)
+    await jobs.start_workers(presence.run_video_job)
+    await streams.start_streams(presence.save_stream_window, presence.names_json_file)
     # await startMinio()
 
 
+@app.on_event("shutdown")
+async def stop_dependencies():
+    for task in background:
+        task.cancel()
+    await asyncio.gather(*background, return_exceptions=True)
+    await streams.stop_streams()
+    await jobs.stop_workers()
+    workers.stop_pool()
+    await mailer.stop_senders()
+
+
 
 app.include_router(auth.router, tags=["Auth"], prefix="/api/auth")
 app.include_router(user.router, tags=["Users"], prefix="/api/users")
@@ -38,3 +75,15 @@ app.include_router(admin.router, tags=["Admin"], prefix="/api/admin")
 @app.get("/api/healthchecker")
 def root():
     return {"message": "Welcome to FastAPI with MongoDB"}
+
+
+@app.get("/metrics", include_in_schema=False)
+def prometheus_metrics():
+    return Response(generate_latest(), media_type=CONTENT_TYPE_LATEST)
+
+
+@app.get("/api/readiness")
+def readiness():
+    if not workers.ready:
+        raise HTTPException(status_code=503, detail="Model is still warming up")
+    return {"status": "ready"}
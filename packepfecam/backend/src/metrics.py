@@ -0,0 +1,78 @@
+import time
+from contextlib import contextmanager
+
+from prometheus_client import Counter, Gauge, Histogram
+
+# Prometheus metrics, served by /metrics in main.py. Everything is exported by
+# the API process: observations made in the inference processes are buffered
+# there and travel back with the result of each call (see call and
+# workers.run), so no multiprocess collector is needed and recording in the
+# hot loops is a list append.
+
+REQUEST_SECONDS = Histogram(
+    "http_request_duration_seconds",
+    "Time until the response starts, per route",
+    ["method", "route", "status"],
+)
+STAGE_SECONDS = Histogram(
+    "pipeline_stage_seconds",
+    "Time spent in each pipeline stage",
+    ["stage"],
+    buckets=(0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 300),
+)
+FRAMES = Counter("pipeline_frames_total", "Video frames decoded and analysed", ["kind"])
+BATCH_SIZE = Histogram("micro_batch_size", "Requests per micro-batch", ["batcher"], buckets=(1, 2, 4, 8, 16, 32, 64))
+MODEL_SECONDS = Gauge("model_startup_seconds", "Latest model export, load and warm-up time", ["phase"])
+QUEUE_DEPTH = Gauge("queue_depth", "Items waiting in each queue", ["queue"])
+EMAILS = Counter("emails_total", "Outbound emails by outcome", ["outcome"])
+
+buffered = False  # set in the inference processes
+pending = []
+
+
+def observe(kind: str, label: str, value: float):
+    if buffered:
+        pending.append((kind, label, value))
+    elif kind == "stage":
+        STAGE_SECONDS.labels(label).observe(value)
+    elif kind == "frames":
+        FRAMES.labels(label).inc(value)
+    elif kind == "model":
+        MODEL_SECONDS.labels(label).set(value)
+
+
+def stage(name: str, seconds: float):
+    observe("stage", name, seconds)
+
+
+def frames(kind: str, count: int):
+    observe("frames", kind, count)
+
+
+def model(phase: str, seconds: float):
+    observe("model", phase, seconds)
+
+
+@contextmanager
+def timed(name: str):
+    started = time.monotonic()
+    try:
+        yield
+    finally:
+        stage(name, time.monotonic() - started)
+
+
+def call(fn, *args, **kwargs):
+    # Runs in an inference process: fn's result and what it observed
+    # (a failed call's observations are dropped so they never reach the next one)
+    global pending
+    try:
+        result = fn(*args, **kwargs)
+    finally:
+        observations, pending = pending, []
+    return result, observations
+
+
+def replay(observations: list):
+    for kind, label, value in observations:
+        observe(kind, label, value)
@@ -1,5 +1,5 @@
-from beanie import Document
+from beanie import Document, Indexed
 
 
 class ApiKey(Document):
-    value : str
\ No newline at end of file
+    value : Indexed(str, unique=True)
\ No newline at end of file
@@ -0,0 +1,17 @@
+from beanie import Document, Indexed
+from datetime import datetime
+from typing import Optional
+
+
+class CachedResult(Document):
+    key: Indexed(str, unique=True)
+    content_digest: str
+    fingerprint: Optional[str] = None
+    model_version: str
+    class_map_version: str
+    options: dict = {}
+    name_frames: dict
+    fps: float
+    created_at: datetime
+    last_used: datetime
+    hits: int = 0
@@ -0,0 +1,19 @@
+from beanie import Document
+from datetime import datetime
+from typing import Optional
+
+
+class VideoJob(Document):
+    status: str = "queued"  # queued, running, done or failed
+    progress: float = 0
+    video_name: str
+    video_path: str
+    api_key: str
+    options: dict = {}
+    content_digest: Optional[str] = None
+    fingerprint: Optional[str] = None
+    results: Optional[list] = None
+    error: Optional[str] = None
+    created_at: datetime
+    finished_at: Optional[datetime] = None
+    heartbeat_at: Optional[datetime] = None
@@ -1,14 +1,34 @@
-from beanie import Document
+from beanie import Document, Indexed
 from datetime import datetime
 from pydantic import BaseModel
-from typing import Any, Dict, Union, List
+from pymongo import ASCENDING, DESCENDING, IndexModel
+from typing import Any, Dict, Union, List, Optional
 
 
 class VideoResponse(Document): 
-    names: dict
+    # Seconds each person was present, keyed by user id; people of the class
+    # map without an account are keyed by name in unknown
+    seconds: Dict[str, float] = {}
+    unknown: Dict[str, float] = {}
     date: datetime
     video_name: str
     api_key: str
+    # Set on the rolling-window reports written for live streams
+    stream_id: Optional[str] = None
+    window_start: Optional[datetime] = None
+    window_end: Optional[datetime] = None
+
+    class Settings:
+        indexes = [
+            # Admin listings page through (date, _id), newest first
+            IndexModel([("date", DESCENDING), ("_id", DESCENDING)]),
+            IndexModel([("api_key", ASCENDING), ("date", DESCENDING), ("_id", DESCENDING)]),
+            # Only live stream windows have a stream_id
+            IndexModel(
+                [("stream_id", ASCENDING), ("window_start", DESCENDING)],
+                partialFilterExpression={"stream_id": {"$type": "string"}},
+            ),
+        ]
 
 
 
@@ -23,14 +43,15 @@ class UserData(BaseModel):
 
 class ImageResponse(Document): 
     names: List[UserData]
-    date: datetime
+    date: Indexed(datetime)
 
 
 class ProcessedImageResponse(BaseModel):
     message: str
     results: List[UserData]
+    artifact_id: str
     json_file: str
-    image_with_boxes: str
+    image_with_boxes: Optional[str] = None
 
 
 class FileDownload(BaseModel):
@@ -0,0 +1,22 @@
+from beanie import Document
+from datetime import datetime
+from pymongo import ASCENDING, IndexModel
+from typing import Optional
+
+
+# Presence per person per day and per week, kept up to date as reports are
+# saved (see reports.py) so analytics never scan the reports themselves
+class AttendanceRollup(Document):
+    period: str  # day or week
+    start: datetime  # midnight of the day, or of the Monday starting the week
+    person: str  # user id, or the class map name of people without an account
+    name: str
+    department: Optional[str] = None
+    seconds: float = 0
+    reports: int = 0  # reports the person was counted in
+    present: int = 0  # of which they were seen in
+
+    class Settings:
+        indexes = [
+            IndexModel([("period", ASCENDING), ("start", ASCENDING), ("person", ASCENDING)], unique=True),
+        ]
@@ -0,0 +1,23 @@
+from beanie import Document
+from datetime import datetime
+from pydantic import BaseModel
+from typing import Optional
+
+
+class VideoStream(Document):
+    source: str  # anything cv2.VideoCapture opens: RTSP/HTTP URL, device index or file
+    name: str
+    api_key: str
+    window_seconds: float
+    status: str = "running"  # running, stopped, finished or failed
+    error: Optional[str] = None
+    created_at: datetime
+    stopped_at: Optional[datetime] = None
+    owner: Optional[str] = None  # id of the API process running it, see streams.py
+    heartbeat_at: Optional[datetime] = None
+
+
+class StreamRequest(BaseModel):
+    source: str
+    name: Optional[str] = None
+    window_seconds: Optional[float] = None
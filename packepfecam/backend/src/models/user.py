@@ -1,7 +1,7 @@
 from datetime import datetime
 from pydantic import BaseModel
 from typing import Optional
-from beanie import Document
+from beanie import Document, Indexed
 
 
 class Register(BaseModel):
@@ -32,9 +32,9 @@ class UserResponse(BaseModel):
 
 
 class User(Document):
-    username: str
-    email: str
-    phone_number: str
+    username: Indexed(str, unique=True)
+    email: Indexed(str, unique=True)
+    phone_number: Indexed(str, unique=True)
     password: str
     created_at: Optional[datetime] = None
     verification_code: Optional[str] = None
@@ -1,12 +1,19 @@
 import base64
+import logging
+import time
 from typing import List
-from fastapi import Depends, HTTPException, status
+from fastapi import Depends, HTTPException, Security, status
+from fastapi.security import APIKeyHeader
 from fastapi_jwt_auth import AuthJWT
 from pydantic import BaseModel
 
+from .models.api_key import ApiKey
 from .models.user import User
 
 from .config.settings import settings
+from . import metrics
+
+logger = logging.getLogger(__name__)
 
 
 class Settings(BaseModel):
@@ -33,12 +40,75 @@ class UserNotFound(Exception):
     pass
 
 
+class AuthCache:
+    # Lookups reused until they expire: found values for AUTH_CACHE_TTL and
+    # misses (None) for AUTH_NEGATIVE_CACHE_TTL. The oldest entries are dropped
+    # beyond AUTH_CACHE_MAX_ENTRIES so a flood of bad keys cannot grow it.
+
+    def __init__(self):
+        self.entries = {}  # key -> (expiry, value or None)
+
+    def get(self, key):
+        cached = self.entries.get(key)
+        if cached and cached[0] > time.monotonic():
+            return True, cached[1]
+        return False, None
+
+    def put(self, key, value):
+        ttl = settings.AUTH_CACHE_TTL if value is not None else settings.AUTH_NEGATIVE_CACHE_TTL
+        self.entries.pop(key, None)
+        self.entries[key] = (time.monotonic() + ttl, value)
+        while len(self.entries) > max(1, settings.AUTH_CACHE_MAX_ENTRIES):
+            del self.entries[next(iter(self.entries))]
+
+    def pop(self, key):
+        self.entries.pop(key, None)
+
+
+api_keys = AuthCache()
+users = AuthCache()
+api_key_header = APIKeyHeader(name="X-API-Key")
+
+
+async def get_api_key(api_key_header: str = Security(api_key_header)) -> str:
+    cached, valid = api_keys.get(api_key_header)
+    if not cached:
+        with metrics.timed("auth_api_key_lookup"):
+            valid = await ApiKey.find_one(ApiKey.value == api_key_header) is not None
+        api_keys.put(api_key_header, True if valid else None)
+    if valid:
+        return api_key_header
+    raise HTTPException(
+        status_code=status.HTTP_401_UNAUTHORIZED,
+        detail="Invalid or missing API Key",
+    )
+
+
+async def get_user(user_id) -> User:
+    # The token's user, shared by every request within AUTH_CACHE_TTL.
+    # Handlers that modify the user load their own copy and invalidate this one.
+    cached, user = users.get(str(user_id))
+    if not cached:
+        with metrics.timed("auth_user_lookup"):
+            user = await User.get(str(user_id))
+        users.put(str(user_id), user)
+    return user
+
+
+def invalidate_api_key(value: str):
+    api_keys.pop(value)
+
+
+def invalidate_user(user_id):
+    users.pop(str(user_id))
+
+
 async def require_user(Authorize: AuthJWT = Depends()):
     try:
         Authorize.jwt_required()
         user_id = Authorize.get_jwt_subject()
 
-        user = await User.get(str(user_id))
+        user = await get_user(user_id)
 
         if not user:
             raise UserNotFound("User no longer exist")
@@ -48,7 +118,7 @@ async def require_user(Authorize: AuthJWT = Depends()):
 
     except Exception as e:
         error = e.__class__.__name__
-        print(e)
+        logger.info("Authentication failed", extra={"reason": error, "error": str(e)})
         if error == "MissingTokenError":
             raise HTTPException(
                 status_code=status.HTTP_401_UNAUTHORIZED, detail="You are not logged in"
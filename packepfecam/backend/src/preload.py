@@ -0,0 +1,13 @@
+# Imported once by the inference forkserver, see workers.start_pool
+import logging
+
+from . import logs
+
+logs.setup()
+try:
+    from .registry import get_model
+
+    get_model()
+except Exception as e:
+    # Children load the model themselves if the forkserver could not
+    logging.getLogger(__name__).warning("Model preload failed", extra={"error": str(e)})
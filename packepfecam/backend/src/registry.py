@@ -0,0 +1,138 @@
+import glob
+import logging
+import os
+import time
+
+import cv2
+import numpy as np
+import torch
+from ultralytics import YOLO
+
+from .config.settings import settings
+from . import metrics
+
+logger = logging.getLogger(__name__)
+
+# One model per weights file per process. The forkserver loads the default
+# model through preload.py, so inference processes forked from it share the
+# weights pages instead of each holding a private copy.
+models = {}
+# Seconds the last export and load took in this process; inherited by the
+# forked children, which report them to the API process, see inference.init_worker
+startup_seconds = {}
+
+# INFERENCE_BACKEND values. The exports are made from MODEL_PATH on first use
+# and written next to it, and made again whenever the checkpoint is newer.
+BACKENDS = ("pytorch", "onnx", "openvino", "int8")
+
+
+def model_path(backend: str = None) -> str:
+    backend = backend or settings.INFERENCE_BACKEND
+    if backend not in BACKENDS:
+        raise ValueError(f"Unknown inference backend {backend!r}, expected one of {', '.join(BACKENDS)}")
+    stem = os.path.splitext(settings.MODEL_PATH)[0]
+    return {
+        "pytorch": settings.MODEL_PATH,
+        "onnx": stem + ".onnx",  # ONNX Runtime
+        "openvino": stem + "_openvino_model",
+        "int8": stem + "_int8.onnx",  # ONNX Runtime, statically quantized
+    }[backend]
+
+
+def get_model(backend: str = None):
+    path = model_path(backend)
+    if path not in models:
+        started = time.monotonic()
+        if path != settings.MODEL_PATH and (not os.path.exists(path) or os.path.getmtime(path) < os.path.getmtime(settings.MODEL_PATH)):
+            export(backend or settings.INFERENCE_BACKEND)
+        model = YOLO(path, task="detect")
+        if path == settings.MODEL_PATH:
+            # Fuse conv+bn now; the predictor would otherwise do it in every child
+            with torch.no_grad():
+                model.fuse()
+        models[path] = model
+        startup_seconds["load"] = time.monotonic() - started
+        metrics.model("load", startup_seconds["load"])
+        logger.info("Loaded model", extra={"path": path, "seconds": round(time.monotonic() - started, 3)})
+    return models[path]
+
+
+def input_size(model) -> int:
+    # Predictions use the image size the weights were trained with
+    imgsz = model.overrides.get("imgsz", 640)
+    return max(imgsz) if isinstance(imgsz, (list, tuple)) else int(imgsz)
+
+
+def export(backend: str):
+    started = time.monotonic()
+    options = {"opset": settings.EXPORT_OPSET} if settings.EXPORT_OPSET else {}
+    if backend in ("onnx", "int8"):
+        # Dynamic axes so frames can still be sent through in batches
+        YOLO(settings.MODEL_PATH).export(format="onnx", dynamic=True, **options)
+    if backend == "openvino":
+        YOLO(settings.MODEL_PATH).export(format="openvino", dynamic=True)
+    if backend == "int8":
+        quantize(model_path("onnx"), model_path("int8"))
+    startup_seconds["export"] = time.monotonic() - started
+    metrics.model("export", startup_seconds["export"])
+    logger.info("Exported model", extra={"path": settings.MODEL_PATH, "backend": backend, "seconds": round(time.monotonic() - started, 3)})
+
+
+def calibration_frames(size: int) -> list:
+    # Model inputs (letterboxed, RGB, CHW, 0-1) for frames spread evenly over
+    # the calibration videos
+    from ultralytics.data.augment import LetterBox
+
+    videos = sorted(glob.glob(settings.CALIBRATION_VIDEOS))
+    if not videos:
+        raise Exception(f"No calibration videos match {settings.CALIBRATION_VIDEOS}")
+    letterbox = LetterBox((size, size), auto=False)
+    per_video = max(1, settings.CALIBRATION_FRAMES // len(videos))
+    inputs = []
+    for video in videos:
+        cap = cv2.VideoCapture(video)
+        total = int(cap.get(cv2.CAP_PROP_FRAME_COUNT))
+        for index in np.linspace(0, max(0, total - 1), per_video).astype(int):
+            cap.set(cv2.CAP_PROP_POS_FRAMES, index)
+            ret, frame = cap.read()
+            if ret:
+                image = letterbox(image=frame)[..., ::-1].transpose(2, 0, 1)
+                inputs.append(np.ascontiguousarray(image[None], np.float32) / 255)
+        cap.release()
+    return inputs
+
+
+def quantize(onnx_path: str, int8_path: str):
+    # Static INT8 (QDQ) quantization with ONNX Runtime, calibrated on frames
+    # from the sample videos
+    import onnxruntime
+    from onnxruntime.quantization import CalibrationDataReader, QuantFormat, QuantType, quantize_static
+
+    session = onnxruntime.InferenceSession(onnx_path, providers=["CPUExecutionProvider"])
+    input_name = session.get_inputs()[0].name
+    frames = iter(calibration_frames(input_size(YOLO(settings.MODEL_PATH))))
+
+    class Frames(CalibrationDataReader):
+        def get_next(self):
+            frame = next(frames, None)
+            return None if frame is None else {input_name: frame}
+
+    quantize_static(
+        onnx_path,
+        int8_path,
+        Frames(),
+        quant_format=QuantFormat.QDQ,
+        activation_type=QuantType.QUInt8,
+        weight_type=QuantType.QInt8,
+        per_channel=True,
+    )
+
+
+def warm_up(model, batch_size: int = 1):
+    started = time.monotonic()
+    size = settings.WARMUP_IMAGE_SIZE
+    frame = np.zeros((size, size, 3), np.uint8)
+    for _ in range(settings.WARMUP_RUNS):
+        model([frame] * batch_size, verbose=False)
+    metrics.model("warmup", time.monotonic() - started)
+    logger.info("Warmed up model", extra={"seconds": round(time.monotonic() - started, 3)})
@@ -0,0 +1,171 @@
+from datetime import datetime, timedelta
+
+from bson import ObjectId
+from bson.errors import InvalidId
+from pymongo import UpdateOne
+
+from .models.response import VideoResponse
+from .models.rollup import AttendanceRollup
+from .models.user import User
+from .profiles import PROFILE_FIELDS, get_profiles
+from . import metrics
+
+# Video reports store numeric seconds keyed by user id. Every saved report is
+# also added to the per-person daily and weekly AttendanceRollup documents,
+# which answer the analytics queries.
+
+PERIODS = ("day", "week")
+
+
+def period_start(date: datetime, period: str) -> datetime:
+    day = datetime(date.year, date.month, date.day)
+    return day - timedelta(days=day.weekday()) if period == "week" else day
+
+
+async def save(name_seconds: dict, **fields) -> VideoResponse:
+    # name_seconds maps class map names to seconds; fields are the other VideoResponse fields
+    profiles = await get_profiles(name_seconds)
+    people = []  # (person, name, department, seconds)
+    for name, seconds in name_seconds.items():
+        profile = profiles[name]
+        person = str(profile["_id"]) if profile else name
+        people.append((person, name, profile.get("department") if profile else None, round(seconds, 2)))
+
+    report = VideoResponse(
+        seconds={person: seconds for person, name, _, seconds in people if profiles[name]},
+        unknown={name: seconds for _, name, _, seconds in people if not profiles[name]},
+        **fields,
+    )
+    with metrics.timed("mongo_insert"):
+        await report.insert()
+    await add_to_rollups(report.date, people)
+    return report
+
+
+def rollup_updates(date: datetime, people: list) -> list:
+    return [
+        UpdateOne(
+            {"period": period, "start": period_start(date, period), "person": person},
+            {
+                "$inc": {"seconds": seconds, "reports": 1, "present": int(seconds > 0)},
+                "$set": {"name": name, "department": department},
+            },
+            upsert=True,
+        )
+        for period in PERIODS
+        for person, name, department, seconds in people
+    ]
+
+
+async def add_to_rollups(date: datetime, people: list):
+    # One unordered bulk write for every person and period of a report
+    updates = rollup_updates(date, people)
+    if updates:
+        with metrics.timed("rollup_update"):
+            await AttendanceRollup.get_motor_collection().bulk_write(updates, ordered=False)
+
+
+async def users_by_id(ids) -> dict:
+    object_ids = []
+    for id in set(ids):
+        try:
+            object_ids.append(ObjectId(id))
+        except InvalidId:
+            pass
+    cursor = User.get_motor_collection().find({"_id": {"$in": object_ids}}, PROFILE_FIELDS)
+    return {str(user["_id"]): user async for user in cursor}
+
+
+async def expand(reports: list) -> list:
+    # Reports with a row per person, details joined from the users in one query
+    users = await users_by_id(id for report in reports for id in report.seconds)
+    expanded = []
+    for report in reports:
+        people = []
+        for id, seconds in report.seconds.items():
+            user = users.get(id, {})
+            people.append({
+                "user_id": id,
+                "name": user.get("username", id),
+                "seconds": seconds,
+                "email": user.get("email", "N/A"),
+                "phone_number": user.get("phone_number", "N/A"),
+                "department": user.get("department", "N/A"),
+                "role": user.get("role", "N/A"),
+            })
+        people.extend({"user_id": None, "name": name, "seconds": seconds} for name, seconds in report.unknown.items())
+        expanded.append({
+            "id": str(report.id),
+            "date": report.date,
+            "video_name": report.video_name,
+            "stream_id": report.stream_id,
+            "window_start": report.window_start,
+            "window_end": report.window_end,
+            "people": people,
+        })
+    return expanded
+
+
+def rollup_ranges(since: datetime, until: datetime) -> list:
+    # (period, start, end) ranges covering whole days from since to until:
+    # weekly rollups for the full weeks inside, daily ones for the days around them
+    since = period_start(since, "day")
+    until = period_start(until, "day") + (timedelta(days=1) if until != period_start(until, "day") else timedelta())
+    first_week = period_start(since + timedelta(days=6), "week")
+    last_week = period_start(until, "week")
+    if first_week >= last_week:
+        return [("day", since, until)]
+    return [("day", since, first_week), ("week", first_week, last_week), ("day", last_week, until)]
+
+
+async def attendance(since: datetime, until: datetime, group: str = "person", interval: str = None) -> list:
+    # Total presence per person or department from since to until, in whole
+    # days. With an interval (day or week) the totals are given per period;
+    # partial weeks at either end only count the days inside the range.
+    ranges = rollup_ranges(since, until)
+    if interval == "day":
+        # Weekly rollups cannot be split into days
+        ranges = [("day", ranges[0][1], ranges[-1][2])]
+    match = {"$or": [{"period": period, "start": {"$gte": start, "$lt": end}} for period, start, end in ranges if start < end]}
+
+    key = {"person": "$person"} if group == "person" else {"department": "$department"}
+    if interval:
+        key["start"] = "$start"
+    pipeline = [
+        {"$match": match},
+        {"$sort": {"start": 1}},
+        {
+            "$group": {
+                "_id": key,
+                "name": {"$last": "$name"},
+                "department": {"$last": "$department"},
+                "people": {"$addToSet": "$person"},
+                "seconds": {"$sum": "$seconds"},
+                "reports": {"$sum": "$reports"},
+                "present": {"$sum": "$present"},
+            }
+        },
+        {"$sort": {"_id.start": 1, "seconds": -1}},
+    ]
+
+    # Rows of daily rollups are added to the week they fall in
+    totals = {}
+    async for row in AttendanceRollup.get_motor_collection().aggregate(pipeline):
+        group_key = row.pop("_id")
+        if interval:
+            group_key["start"] = period_start(group_key["start"], interval)
+        entry = totals.setdefault(tuple(group_key.items()), {**group_key, "seconds": 0, "reports": 0, "present": 0, "people": set()})
+        for field in ("seconds", "reports", "present"):
+            entry[field] += row[field]
+        entry["people"].update(row["people"])
+        if group == "person":
+            # Rows come oldest first, so the latest name and department win
+            entry.update(name=row["name"], department=row["department"])
+
+    rows = []
+    for entry in sorted(totals.values(), key=lambda e: (e.get("start") or datetime.min, -e["seconds"])):
+        people = entry.pop("people")
+        if group != "person":
+            entry["people"] = len(people)
+        rows.append(entry)
+    return rows
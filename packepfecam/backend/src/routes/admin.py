@@ -1,47 +1,56 @@
 from fastapi import APIRouter, Depends, HTTPException, status
 from typing import List
+from datetime import datetime
 from ..models.user import User
 from ..models.response import VideoResponse
 from fastapi import HTTPException, Security
-from fastapi.security import APIKeyHeader
+import logging
 import uuid
 from ..models.api_key import ApiKey
+from ..oauth2 import get_api_key, invalidate_api_key
+from .. import listing, reports
 
+logger = logging.getLogger(__name__)
 router = APIRouter()
 
-
-api_key_header = APIKeyHeader(name="X-API-Key")
-
-
-
-async def get_api_key(api_key_header: str = Security(api_key_header)) -> str:
-    key = await ApiKey.find_one(ApiKey.value == api_key_header)
-    if key:
-        return api_key_header
-    raise HTTPException(
-        status_code=status.HTTP_401_UNAUTHORIZED,
-        detail="Invalid or missing API Key",
-    )
-
+# Fields the listings can project; password hashes and verification codes are never sent
+USER_FIELDS = {"username", "email", "phone_number", "department", "role", "created_at", "is_verified"}
+RESPONSE_FIELDS = {"seconds", "unknown", "date", "video_name", "api_key", "stream_id", "window_start", "window_end"}
 
 
+# Listings are newest first and paginated: pass next_cursor back as cursor for
+# the next page. fields is a comma-separated projection; format=ndjson streams
+# every matching document instead of one page.
 @router.get("/all-users")
-async def get_all_users(api_key: str = Security(get_api_key)):
-    try:
-        users = await User.find().to_list()
-        return {"users":users}
-    except Exception as e:
-        raise HTTPException(status_code=404, detail=str(e))
+async def get_all_users(
+    cursor: str = None,
+    limit: int = None,
+    since: datetime = None,
+    until: datetime = None,
+    fields: str = None,
+    format: str = "json",
+    api_key: str = Security(get_api_key),
+):
+    return await listing.respond(
+        User.get_motor_collection(), "users", {}, USER_FIELDS, "created_at", since, until, fields, cursor, limit, format,
+        # created_at is missing on older accounts
+        sort_by_date=False,
+    )
 
 
 @router.get("/all-responses")
-async def get_all_responses(api_key: str = Security(get_api_key)):
-    try:
-        responses = await VideoResponse.find().to_list()
-        print("responses",responses)
-        return {"responses":responses}
-    except Exception as e:
-        raise HTTPException(status_code=404, detail=str(e))
+async def get_all_responses(
+    cursor: str = None,
+    limit: int = None,
+    since: datetime = None,
+    until: datetime = None,
+    fields: str = None,
+    format: str = "json",
+    api_key: str = Security(get_api_key),
+):
+    return await listing.respond(
+        VideoResponse.get_motor_collection(), "responses", {}, RESPONSE_FIELDS, "date", since, until, fields, cursor, limit, format
+    )
     
 
 
@@ -51,6 +60,7 @@ async def generate_api_key():
         api_key = str(uuid.uuid4())
         api_key_obj = ApiKey(value=api_key)
         await ApiKey.insert_one(api_key_obj)
+        invalidate_api_key(api_key)
         return {"api_key":api_key, "status":"success"}
     except Exception as e:
         raise HTTPException(status_code=404, detail=str(e))
@@ -59,14 +69,35 @@ async def generate_api_key():
 
 
 @router.get("/get-response-by-api-key")
-async def get_response_by_api_key(api_key: str = Security(get_api_key)):
-    try:
-        # Fetch the data from the database
-        response = await VideoResponse.find(VideoResponse.api_key == api_key).to_list()
+async def get_response_by_api_key(
+    cursor: str = None,
+    limit: int = None,
+    since: datetime = None,
+    until: datetime = None,
+    fields: str = None,
+    format: str = "json",
+    api_key: str = Security(get_api_key),
+):
+    return await listing.respond(
+        VideoResponse.get_motor_collection(), "responses", {"api_key": api_key}, RESPONSE_FIELDS, "date", since, until, fields, cursor, limit, format
+    )
 
-        # Convert the database objects to the Pydantic model
-        # response_data = [VideoResponse.from_orm(res) for res in response]
 
-        return response
-    except Exception as e:
-        raise HTTPException(status_code=404, detail=str(e))
\ No newline at end of file
+@router.get("/attendance")
+async def get_attendance(
+    since: datetime,
+    until: datetime,
+    group: str = "person",
+    interval: str = None,
+    api_key: str = Security(get_api_key),
+):
+    # Total presence per person or department over whole days, answered from
+    # the daily and weekly rollups; interval=day or week breaks it down per period
+    if group not in ("person", "department"):
+        raise HTTPException(status_code=400, detail="group must be person or department")
+    if interval not in (None, *reports.PERIODS):
+        raise HTTPException(status_code=400, detail="interval must be day or week")
+    if since >= until:
+        raise HTTPException(status_code=400, detail="since must be before until")
+    results = await reports.attendance(since, until, group, interval)
+    return {"since": since, "until": until, "group": group, "interval": interval, "results": results}
@@ -4,7 +4,9 @@ from fastapi import APIRouter, Response, status, Depends, HTTPException, Path
 from ..models.user import User, Login, Register, UserResponse
 from .. import utils
 from .. import oauth2
+from .. import profiles
 from fastapi_jwt_auth import AuthJWT
+from pymongo.errors import DuplicateKeyError
 from ..config.settings import settings
 
 router = APIRouter()
@@ -26,12 +28,16 @@ async def create_user(credentials: Register):
             status_code=status.HTTP_400_BAD_REQUEST, detail="Invalid phone number"
         )
 
-    user_exists = await User.find_one(User.username == credentials.username)
-    email_exists = await User.find_one(User.email == credentials.email)
-    phone_number_exists = await User.find_one(
-        User.phone_number == credentials.phone_number
+    account_exists = await User.find_one(
+        {
+            "$or": [
+                {"username": credentials.username},
+                {"email": credentials.email.lower()},
+                {"phone_number": credentials.phone_number},
+            ]
+        }
     )
-    if user_exists or email_exists or phone_number_exists:
+    if account_exists:
         raise HTTPException(
             status_code=status.HTTP_409_CONFLICT, detail="Account already exists"
         )
@@ -40,7 +46,7 @@ async def create_user(credentials: Register):
         username=credentials.username,
         email=credentials.email.lower(),
         phone_number=credentials.phone_number,
-        password=utils.hash_password(credentials.password),
+        password=await utils.hash_password(credentials.password),
         created_at=datetime.utcnow(),
         department=credentials.department,
         role=credentials.role,
@@ -48,11 +54,19 @@ async def create_user(credentials: Register):
 
     #     await new_user.create()
 
-    # Generate a verification code and send it to the user's email
-    verification_code = utils.generate_verification_code()
-    await utils.send_verification_email(new_user.email, verification_code)
-    new_user.verification_code = verification_code
-    await new_user.save()
+    # Generate a verification code, sent to the user's email once the account is saved
+    new_user.verification_code = utils.generate_verification_code()
+    utils.check_mail_queue()
+    try:
+        await new_user.save()
+    except DuplicateKeyError:
+        # Registered concurrently since the check above
+        raise HTTPException(
+            status_code=status.HTTP_409_CONFLICT, detail="Account already exists"
+        )
+    await utils.send_verification_email(new_user.email, new_user.verification_code)
+    # Reports may have cached this username as unknown
+    profiles.invalidate(new_user.username)
 
     r_user = UserResponse(
         username=new_user.username,
@@ -80,6 +94,7 @@ async def verify_email(email: str, verification_code: str):
     # Mark the user as verified in the database
     user.is_verified = True
     await user.save()
+    oauth2.invalidate_user(user.id)
 
     return {"message": "Email verified successfully"}
 
@@ -102,7 +117,7 @@ async def login(credentials: Login, response: Response, Authorize: AuthJWT = Dep
     if not user.is_verified:
         raise HTTPException(status_code=403, detail="Email not verified")
 
-    if not utils.verify_password(credentials.password, user.password):
+    if not await utils.verify_password(credentials.password, user.password):
         raise HTTPException(
             status_code=status.HTTP_400_BAD_REQUEST,
             detail="Incorrect password",
@@ -1,112 +1,195 @@
+import asyncio
 import json
-from fastapi import APIRouter, BackgroundTasks, File, UploadFile, Depends, HTTPException
-from fastapi.responses import FileResponse
-import cv2
-from ultralytics import YOLO
-import numpy as np
-from PIL import Image
+import logging
+import os
+import zipfile
+from typing import List
+from fastapi import APIRouter, BackgroundTasks, File, UploadFile, Depends, HTTPException, Request
+from fastapi.responses import Response, StreamingResponse
 from ..models.response import ProcessedImageResponse, ImageResponse, UserData
 from ..oauth2 import require_user
 from ..config.settings import settings
-from motor.motor_asyncio import AsyncIOMotorClient
-from ..utils import save_json_file
 from datetime import datetime, timedelta
-
+from beanie import PydanticObjectId
+from .. import workers, inference, metrics
+from ..artifacts import store
+from ..batching import MicroBatcher
+from ..class_map import load_class_map
+from ..profiles import get_profiles
+
+logger = logging.getLogger(__name__)
 router = APIRouter()
-client = AsyncIOMotorClient(settings.DATABASE_URL)
-db = client.db_name
-collection = db["User"]
+names_json_file = "/app/FILES/results.json"
 
-# Initialize YOLO model
-model = YOLO("/app/src/routes/YOLO/best.pt")
-output_json_file = "/app/FILES/name_durations.json"
-output_image_file = "/app/FILES/results.jpg"
 
+async def run_image_batch(items: list) -> list:
+    # items are (image bytes, whether to draw the annotated image)
+    class_map = load_class_map(names_json_file)
+    contents = [content for content, _ in items]
+    return await workers.run(inference.analyse_images, contents, class_map, [render for _, render in items])
 
-async def get_user_data(name: str):
-    user_data = await collection.find_one({"username": name})
-    return user_data
 
-async def process_image_file(file: UploadFile):
-    content = await file.read()
-    nparr = np.frombuffer(content, np.uint8)
-    img = cv2.imdecode(nparr, cv2.IMREAD_COLOR)
-    return img
+# Concurrent process_image calls are batched into one inference call
+image_batcher = MicroBatcher("image", run_image_batch, settings.IMAGE_BATCH_SIZE, settings.IMAGE_BATCH_WINDOW_MS / 1000)
 
 
 async def save_to_database(name_durations: list):
     try:
         names_response = ImageResponse(names=name_durations, date=(datetime.now() + timedelta(hours=1)))
-        await ImageResponse.insert_one(names_response)
+        with metrics.timed("mongo_insert"):
+            await ImageResponse.insert_one(names_response)
     except Exception as e:
         raise e
 
 
-async def process_results(results, names_data):
-    name_durations = {name_data["name"]: "Absent" for name_data in names_data}
-    for r in results:
-        for name_data in names_data:
-            if name_data["class"] in r.boxes.cls:
-                name = name_data["name"]
-                name_durations[name] = "Present"
-    return name_durations
-
-async def prepare_response(name_durations):
+async def user_data(name_durations: dict) -> list:
     response_data = []
+    profiles = await get_profiles(name_durations)
     for name, duration in name_durations.items():
-        user_data = await get_user_data(name)
+        user_data = profiles[name]
         email = user_data.get("email") if user_data else "N/A"
         phone_number = user_data.get("phone_number") if user_data else "N/A"
         department = user_data.get("department") if user_data else "N/A"
         role = user_data.get("role") if user_data else "N/A"
-        print(f"Name: {name}, Attendance: {duration}, Email: {email}, Phone: {phone_number}", "\n\n\n")
+        logger.debug("Attendance", extra={"person": name, "attendance": duration})
         response_data.append(UserData(name=name ,attendance=duration, email=email, phone_number=phone_number, department=department, role=role))
+    return response_data
+
+
+async def prepare_response(name_durations):
+    response_data = await user_data(name_durations)
     await save_to_database(response_data)
     return response_data
 
 
 @router.post("/process_image", response_model=ProcessedImageResponse)
-async def process_image(background_tasks: BackgroundTasks, file: UploadFile = File(...), user=Depends(require_user)):
+async def process_image(request: Request, background_tasks: BackgroundTasks, file: UploadFile = File(...), render: bool = False, user=Depends(require_user)):
+    content = await file.read()
     try:
-        with open("/app/FILES/results.json", "r") as f:
-            names_data = json.load(f)
+        # Decoding, inference and (with render) drawing the boxes run in an inference process
+        name_durations, image = await image_batcher.submit((content, render))
     except FileNotFoundError:
         raise HTTPException(status_code=404, detail="Results file not found.")
-    
-    img = await process_image_file(file)
-    results = model(img)
-    name_durations = await process_results(results, names_data)
-    await save_json_file(name_durations, output_json_file)
+    except workers.PoolBusy as e:
+        raise HTTPException(status_code=503, detail=str(e))
+    if name_durations is None:
+        raise HTTPException(status_code=400, detail="Could not decode image.")
 
-    for r in results:
-        im_array = r.plot()
-        im = Image.fromarray(im_array[..., ::-1])
-        im.save(output_image_file)
+    # The downloads are kept under this request's id
+    artifact_id = str(PydanticObjectId())
+    await asyncio.to_thread(store.put, artifact_id, "json", str(user), json.dumps(name_durations).encode(), "application/json")
+    if image:
+        await asyncio.to_thread(store.put, artifact_id, "image", str(user), image, "image/jpeg")
 
     processed_image_response = await prepare_response(name_durations)
 
-
-
-    json_file_path = str(output_json_file)
-    image_file_path = str(output_image_file)
-
     return ProcessedImageResponse(
         message="Processing completed. Check JSON file for results.",
         results=processed_image_response,
-        json_file=json_file_path,
-        image_with_boxes=image_file_path  
+        artifact_id=artifact_id,
+        json_file=f"{request.url_for('download_json_file')}?artifact_id={artifact_id}",
+        image_with_boxes=f"{request.url_for('download_image_file')}?artifact_id={artifact_id}" if image else None,
     )
 
-@router.get("/get-json_file")
-async def download_json_file(user=Depends(require_user)):
+def image_sources(files: List[UploadFile]) -> list:
+    # (filename, read) for every image, zip archives expanded. Images are only
+    # read when their batch is about to be analysed.
+    sources = []
+    for file in files:
+        if file.filename.lower().endswith(".zip") or file.content_type in ("application/zip", "application/x-zip-compressed"):
+            try:
+                archive = zipfile.ZipFile(file.file)
+            except zipfile.BadZipFile:
+                raise HTTPException(status_code=400, detail=f"{file.filename} is not a valid zip archive")
+            for entry in archive.infolist():
+                if entry.is_dir() or os.path.basename(entry.filename).startswith("."):
+                    continue
+                if entry.file_size > settings.MAX_IMAGE_BYTES:
+                    raise HTTPException(status_code=413, detail=f"{entry.filename} is larger than {settings.MAX_IMAGE_BYTES} bytes")
+                sources.append((entry.filename, lambda archive=archive, entry=entry: archive.read(entry)))
+        else:
+            sources.append((file.filename, lambda file=file: file.file.read()))
+        if len(sources) > settings.MAX_BULK_IMAGES:
+            raise HTTPException(status_code=413, detail=f"At most {settings.MAX_BULK_IMAGES} images per request")
+    return sources
+
+
+@router.post("/process_images")
+async def process_images(files: List[UploadFile] = File(...), user=Depends(require_user)):
+    # Many images, or zip archives of images, in one request. They go through
+    # the model in batches and one NDJSON line per image is streamed back as
+    # each batch finishes. No annotated images are drawn.
     try:
-        return FileResponse(output_json_file)
+        class_map = load_class_map(names_json_file)
     except FileNotFoundError:
-        raise HTTPException(status_code=404, detail="JSON file not found.")
+        raise HTTPException(status_code=404, detail="Results file not found.")
+
+    if workers.full():
+        raise HTTPException(status_code=503, detail="Inference workers are busy, try again later")
+    sources = image_sources(files)
+    batches = [sources[i : i + inference.batch_size] for i in range(0, len(sources), inference.batch_size)]
+
+    async def analyse(batch):
+        contents = await asyncio.to_thread(lambda: [read() for _, read in batch])
+        # Counted against INFERENCE_QUEUE_SIZE like single images; once the
+        # response has started, later batches wait for room instead of failing
+        return await workers.run(inference.analyse_images, contents, class_map, wait=True)
+
+    async def results():
+        in_flight = max(1, settings.INFERENCE_PROCESSES)
+        tasks = [asyncio.create_task(analyse(batch)) for batch in batches[:in_flight]]
+        index = 0
+        try:
+            for i, batch in enumerate(batches):
+                try:
+                    seen = await tasks[i]
+                except Exception as e:
+                    seen = [e] * len(batch)
+                if i + in_flight < len(batches):
+                    tasks.append(asyncio.create_task(analyse(batches[i + in_flight])))
+
+                lines, documents = [], []
+                for (filename, _), analysed in zip(batch, seen):
+                    name_durations = analysed if isinstance(analysed, Exception) else analysed[0]
+                    if isinstance(name_durations, Exception):
+                        lines.append({"index": index, "filename": filename, "error": str(name_durations)})
+                    elif name_durations is None:
+                        lines.append({"index": index, "filename": filename, "error": "Could not decode image"})
+                    else:
+                        rows = await user_data(name_durations)
+                        documents.append(ImageResponse(names=rows, date=(datetime.now() + timedelta(hours=1))))
+                        lines.append({"index": index, "filename": filename, "results": [row.dict() for row in rows]})
+                    index += 1
+                if documents:
+                    with metrics.timed("mongo_insert"):
+                        await ImageResponse.insert_many(documents)
+                yield "".join(json.dumps(line) + "\n" for line in lines)
+        finally:
+            for task in tasks:
+                task.cancel()
+
+    return StreamingResponse(results(), media_type="application/x-ndjson")
+
+
+@router.get("/batching-stats")
+async def batching_stats(user=Depends(require_user)):
+    # Batch fill rate and queueing delay of the process_image micro-batcher
+    return image_batcher.stats()
+
+
+async def download(artifact_id: str, kind: str, user) -> Response:
+    artifact = await asyncio.to_thread(store.get, artifact_id, kind, str(user))
+    if not artifact:
+        raise HTTPException(status_code=404, detail=f"{'JSON' if kind == 'json' else 'Image'} file not found.")
+    data, media_type = artifact
+    return Response(content=data, media_type=media_type)
+
+
+@router.get("/get-json_file")
+async def download_json_file(artifact_id: str, user=Depends(require_user)):
+    return await download(artifact_id, "json", user)
+
 
 @router.get("/get-image_file")
-async def download_image_file(user=Depends(require_user)):
-    try:
-        return FileResponse(output_image_file)
-    except FileNotFoundError:
-        raise HTTPException(status_code=404, detail="Image file not found.")
+async def download_image_file(artifact_id: str, user=Depends(require_user)):
+    return await download(artifact_id, "image", user)
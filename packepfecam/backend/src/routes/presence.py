@@ -1,133 +1,124 @@
+import asyncio
 import json
+import logging
 import os
-import cv2
-from fastapi import APIRouter, File, UploadFile,status
-from ultralytics import YOLO
-import aiofiles
+from fastapi import APIRouter, Request, status
 from ..models.response import VideoResponse  
 from datetime import datetime, timedelta
-from motor.motor_asyncio import AsyncIOMotorClient
 from ..config.settings import settings
 from fastapi import HTTPException, Security
-from fastapi.security import APIKeyHeader
-from ..models.api_key import ApiKey
+from ..models.job import VideoJob
+from ..models.stream import VideoStream, StreamRequest
+from beanie import PydanticObjectId
+from .. import jobs, workers, inference, ingest, cache, streams, metrics, reports
+from ..class_map import load_class_map
+from ..profiles import get_profiles
+from ..oauth2 import get_api_key
 
 
+logger = logging.getLogger(__name__)
 router = APIRouter()
-api_key_header = APIKeyHeader(name="X-API-Key")
 
 
-
-
-
-async def get_api_key(api_key_header: str = Security(api_key_header)) -> str:
-    key = await ApiKey.find_one(ApiKey.value == api_key_header)
-    if key:
-        return api_key_header
-    raise HTTPException(
-        status_code=status.HTTP_401_UNAUTHORIZED,
-        detail="Invalid or missing API Key",
-    )
-
-client = AsyncIOMotorClient(settings.DATABASE_URL)
-db = client.db_name
-collection = db["User"]
- 
-# Load the YOLO model during startup
-model = YOLO("/app/src/routes/YOLO/best.pt") 
- 
 output_json_file = "/app/FILES/name_durations.json"
 names_json_file = "/app/FILES/results.json"
 video_dir = "/app/uploads/"
  
  
-async def save_to_database(name_durations: dict, video_name:str, api_key: str):
+async def save_to_database(name_seconds: dict, video_name:str, api_key: str):
     try:
-        names_response = VideoResponse(names=name_durations, date=(datetime.now() + timedelta(hours=1)), video_name=video_name, api_key=api_key)
-        await VideoResponse.insert_one(names_response)
+        await reports.save(name_seconds, date=(datetime.now() + timedelta(hours=1)), video_name=video_name, api_key=api_key)
     except Exception as e:
         raise e
  
  
  
-async def process_video(video_file: UploadFile, api_key):
-    print("Processing video...")
-    try:
-        with open(names_json_file, "r") as f:
-            names_data = json.load(f)
- 
-        name_durations = {entry["name"]: 0 for entry in names_data}
- 
-        video_path = os.path.join(video_dir, video_file.filename)
-        async with aiofiles.open(video_path, "wb") as buffer:
-            while True:
-                chunk = await video_file.read(1024)
-                if not chunk:
-                    break
-                await buffer.write(chunk)
- 
-        cap = cv2.VideoCapture(video_path)
- 
-        if not cap.isOpened():
-            raise Exception("Failed to open video file")
- 
-        fps = cap.get(cv2.CAP_PROP_FPS)  
-        total_frames = int(cap.get(cv2.CAP_PROP_FRAME_COUNT))  
+async def analyse_video(job: VideoJob, class_map, progress=None, cached=None):
+    # cached is a CachedResult the caller already looked up
+    if cached is None and job.content_digest:
+        cached = await cache.lookup(job.content_digest, job.options, names_json_file)
+    if cached:
+        logger.info("Reusing cached results for identical video", extra={"job_id": str(job.id)})
+        return dict(cached.name_frames), cached.fps
+
+    name_frames, fps = await analyse_segments(job, class_map, progress)
+
+    # Streamed uploads are only fully hashed after their job has started
+    if not job.content_digest:
+        job = await VideoJob.get(job.id)
+    if job.content_digest:
+        await cache.store(job.content_digest, job.fingerprint, job.options, names_json_file, name_frames, fps)
+    return name_frames, fps
  
-        for _ in range(total_frames):
-            ret, frame = cap.read()
-            if not ret:
-                break  
  
-            results = model(frame)
+async def analyse_segments(job: VideoJob, class_map, progress=None):
+    # Runs the segments of a long video in parallel inference processes and
+    # adds up their counts, which gives the same result as a sequential run
+    options = dict(job.options)
+    segments = options.pop("segments", None) or settings.VIDEO_SEGMENTS
+    fps, total_frames = await asyncio.to_thread(inference.probe_video, job.video_path)
+    # Budgeted sampling and tracks depend on the frames before them, and a
+    # streamed upload is decoded in order as it arrives
+    sequential = (
+        segments <= 1
+        or options.get("time_budget") or settings.PROCESSING_TIME_BUDGET
+        or (settings.TRACKING if options.get("tracking") is None else options["tracking"])
+        or os.path.exists(ingest.uploading_marker(job.video_path))
+        or not fps
+        or not total_frames
+    )
+    ranges = [(0, None)]
+    if not sequential:
+        stride = inference.pick_stride(fps, options.get("stride"), options.get("max_fps"))
+        ranges = inference.split_segments(total_frames, segments, stride, settings.MIN_SEGMENT_SECONDS * fps)
+
+    done = [0.0] * len(ranges)
+
+    def on_progress(i, start, end):
+        async def report(fraction: float):
+            done[i] = fraction * (end - start) / total_frames if end else fraction
+            await progress(sum(done))
+        return report
+
+    results = await asyncio.gather(*[
+        workers.run(
+            inference.analyse_video,
+            job.video_path,
+            class_map,
+            start=start,
+            end=end,
+            on_progress=on_progress(i, start, end) if progress else None,
+            bounded=False,
+            **options,
+        )
+        for i, (start, end) in enumerate(ranges)
+    ])
+
+    name_frames = dict.fromkeys(results[0][0], 0)
+    for counts, _ in results:
+        for name, frames in counts.items():
+            name_frames[name] += frames
+    return name_frames, results[0][1]
+
+
+async def process_video(job: VideoJob, progress=None, cached=None):
+    logger.info("Processing video", extra={"job_id": str(job.id), "video": job.video_name})
+    try:
+        class_map = load_class_map(names_json_file)
  
-            for r in results:
-                for name_data in names_data:
-                    if name_data["class"] in r.boxes.cls:
-                        name = name_data["name"]
-                        name_durations[name] += 1
+        name_frames, fps = await analyse_video(job, class_map, progress, cached)
  
         # Transform durations to seconds and add "sec" to each value
-        for name in name_durations:
-            name_durations[name] /= fps
-            name_durations[name] = round(name_durations[name])
-            name_durations[name] = str(name_durations[name]) + "sec"
-        print(name_durations)
-        response_data = []
-        for name, duration in name_durations.items():
-            user_data = await collection.find_one({"username": name})   
-            email = user_data.get("email") if user_data else "N/A"
-            phone_number = user_data.get("phone_number") if user_data else "N/A"
-            department = user_data.get("department") if user_data else "N/A"
-            role = user_data.get("role") if user_data else "N/A"
-            print(f"Name: {name}, Attendance: {duration}, Email: {email}, Phone: {phone_number}", "\n\n\n")
-            name_durations[name] = {
-                "duration": duration,
-                "email": email,
-                "phone_number": phone_number,
-                "department": department,
-                "role": role
-            }
-            response_data.append({
-                "name": name,
-                "duration": duration,
-                "email": email,
-                "phone_number": phone_number,
-                "department": department,
-                "role": role,
-                "attendance": "Present" if duration != "0sec" else "Absent"
-            })
+        name_seconds = {name: frames / fps for name, frames in name_frames.items()}
+        name_durations = {name: str(round(seconds)) + "sec" for name, seconds in name_seconds.items()}
+        logger.debug("Video durations", extra={"job_id": str(job.id), "durations": name_durations})
+        response_data = await add_profiles(name_durations)
  
- 
-        video_name = f"app/uploads/{video_file.filename}"
-        await save_to_database(name_durations, video_name,api_key)
+        await save_to_database(name_seconds, job.video_name, job.api_key)
        
         with open(output_json_file, "w") as json_file:
             json.dump(name_durations, json_file)
  
-        # Close the video file
-        cap.release()
- 
         # Delete the video file
         # os.remove(video_path)
  
@@ -135,15 +126,269 @@ async def process_video(video_file: UploadFile, api_key):
  
     except Exception as e:
         raise e
+
+
+async def add_profiles(name_durations: dict) -> list:
+    # Replaces each duration with the person's details and returns the response rows
+    response_data = []
+    profiles = await get_profiles(name_durations)
+    for name, duration in name_durations.items():
+        user_data = profiles[name]
+        email = user_data.get("email") if user_data else "N/A"
+        phone_number = user_data.get("phone_number") if user_data else "N/A"
+        department = user_data.get("department") if user_data else "N/A"
+        role = user_data.get("role") if user_data else "N/A"
+        logger.debug("Attendance", extra={"person": name, "duration": duration})
+        name_durations[name] = {
+            "duration": duration,
+            "email": email,
+            "phone_number": phone_number,
+            "department": department,
+            "role": role
+        }
+        response_data.append({
+            "name": name,
+            "duration": duration,
+            "email": email,
+            "phone_number": phone_number,
+            "department": department,
+            "role": role,
+            "attendance": "Present" if duration != "0sec" else "Absent"
+        })
+    return response_data
  
 
-@router.post("/process_video")
-async def process_video_endpoint(video_file: UploadFile = File(...),api_key: str = Security(get_api_key)):
+async def run_video_job(job: VideoJob, progress):
     try:
-        response = await process_video(video_file,str(api_key))
-    
-        success_message = "Video processing completed successfully!"
-        print(success_message)
-        return {"results":response,"video_file": f"app/uploads/{video_file.filename}"}
-    except Exception as e:
-        return {"error": str(e)}
\ No newline at end of file
+        response = await process_video(job, progress)
+    except Exception:
+        # The job fails for good; an aborted upload it was trailing is of no further use
+        if os.path.exists(ingest.aborted_marker(job.video_path)):
+            ingest.discard(job.video_path)
+        raise
+    logger.info("Video processing completed", extra={"job_id": str(job.id)})
+    return response
+
+
+async def save_stream_window(stream: VideoStream, window_start: datetime, window_end: datetime, name_seconds: dict):
+    # One VideoResponse per rolling window of a live stream, see streams.py
+    await reports.save(
+        name_seconds,
+        date=window_end + timedelta(hours=1),
+        video_name=stream.name,
+        api_key=stream.api_key,
+        stream_id=str(stream.id),
+        window_start=window_start,
+        window_end=window_end,
+    )
+ 
+
+# The upload is parsed from the raw request stream (see ingest.py), so the
+# multipart body is described here for the docs instead of as an UploadFile
+upload_body = {
+    "requestBody": {
+        "required": True,
+        "content": {
+            "multipart/form-data": {
+                "schema": {
+                    "type": "object",
+                    "properties": {"video_file": {"type": "string", "format": "binary"}},
+                    "required": ["video_file"],
+                }
+            }
+        },
+    }
+}
+
+
+@router.post("/process_video", status_code=status.HTTP_202_ACCEPTED, openapi_extra=upload_body)
+async def process_video_endpoint(
+    request: Request,
+    api_key: str = Security(get_api_key),
+    stride: int = None,
+    max_fps: float = None,
+    time_budget: float = None,
+    tracking: bool = None,
+    segments: int = None,
+):
+    job_id = PydanticObjectId()
+    job = None
+    submitted = False
+
+    def path_for(filename: str) -> str:
+        # Prefix uploads with the job id so concurrent jobs never share a file
+        nonlocal job
+        filename = f"{job_id}_{filename}"
+        job = VideoJob(
+            id=job_id,
+            video_name=f"app/uploads/{filename}",
+            video_path=os.path.join(video_dir, filename),
+            api_key=str(api_key),
+            options={"stride": stride, "max_fps": max_fps, "time_budget": time_budget, "tracking": tracking, "segments": segments},
+            created_at=datetime.utcnow(),
+        )
+        return job.video_path
+
+    async def submit():
+        nonlocal submitted
+        await job.insert()
+        submitted = True
+        jobs.submit(job)
+
+    async def abandon(error: str):
+        # A job no worker is running is failed here and its upload removed. A
+        # running one fails on the aborted marker and run_video_job removes it.
+        if submitted:
+            failed = {"status": "failed", "error": error, "finished_at": datetime.utcnow()}
+            idle = await VideoJob.get_motor_collection().update_one(
+                {"_id": job_id, "status": {"$in": ["queued", "failed"]}}, {"$set": failed}
+            )
+            if not idle.matched_count:
+                await job.set(failed)
+                return
+        if job:
+            ingest.discard(job.video_path)
+
+    async def submit_early(fingerprint: str):
+        # Skip the head start when this stream was probably processed before,
+        # so the full upload can be checked against the result cache
+        if not await cache.seen_fingerprint(fingerprint, names_json_file):
+            job.fingerprint = fingerprint
+            await submit()
+
+    try:
+        # Fast-start videos are queued while the rest of the upload is still arriving
+        with metrics.timed("upload"):
+            _, content_digest, fingerprint = await ingest.receive_video(
+                request, path_for, submit_early if settings.STREAM_DECODE else None
+            )
+        if submitted:
+            await job.set({VideoJob.content_digest: content_digest})
+        else:
+            job.content_digest = content_digest
+            job.fingerprint = fingerprint
+            # Identical videos are answered from the cache without queueing;
+            # the entry is passed on so nothing is analysed inside the request
+            cached = await cache.lookup(content_digest, job.options, names_json_file)
+            if cached:
+                job.status = "done"
+                job.progress = 100
+                job.results = await process_video(job, cached=cached)
+                job.finished_at = datetime.utcnow()
+                await job.insert()
+                return {"job_id": str(job.id), "status": job.status, "results": job.results, "video_file": job.video_name}
+            await submit()
+    except BaseException as e:
+        # Also when the client goes away: a job already queued from a partial
+        # upload must not look pending forever, nor its file stay behind
+        await abandon(str(e.detail if isinstance(e, HTTPException) else e) or type(e).__name__)
+        if isinstance(e, jobs.QueueFull):
+            raise HTTPException(status_code=status.HTTP_503_SERVICE_UNAVAILABLE, detail=str(e))
+        if isinstance(e, HTTPException) or not isinstance(e, Exception):
+            raise
+        logger.error("Video upload failed", extra={"job_id": str(job_id), "error": str(e)})
+        raise HTTPException(status_code=status.HTTP_500_INTERNAL_SERVER_ERROR, detail=str(e))
+
+    return {"job_id": str(job.id), "status": "queued", "video_file": job.video_name}
+
+
+async def get_job(job_id: str, api_key: str) -> VideoJob:
+    job = await VideoJob.get(job_id) if PydanticObjectId.is_valid(job_id) else None
+    if not job or job.api_key != api_key:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Job not found")
+    return job
+
+
+@router.get("/jobs/{job_id}")
+async def get_job_status(job_id: str, api_key: str = Security(get_api_key)):
+    job = await get_job(job_id, api_key)
+    return {
+        "job_id": str(job.id),
+        "status": job.status,
+        "progress": job.progress,
+        "error": job.error,
+        "video_file": job.video_name,
+    }
+
+
+@router.get("/jobs/{job_id}/result")
+async def get_job_result(job_id: str, api_key: str = Security(get_api_key)):
+    job = await get_job(job_id, api_key)
+    if job.status == "failed":
+        return {"error": job.error}
+    if job.status != "done":
+        raise HTTPException(
+            status_code=status.HTTP_409_CONFLICT,
+            detail=f"Job is {job.status} ({job.progress}%)",
+        )
+    return {"results": job.results, "video_file": job.video_name}
+
+
+def describe_stream(stream: VideoStream) -> dict:
+    session = streams.sessions.get(stream.id)
+    return {
+        "stream_id": str(stream.id),
+        "name": stream.name,
+        "source": stream.source,
+        "window_seconds": stream.window_seconds,
+        "status": stream.status,
+        "error": stream.error,
+        "stats": session.stats() if session else None,
+    }
+
+
+async def get_stream(stream_id: str, api_key: str) -> VideoStream:
+    stream = await VideoStream.get(stream_id) if PydanticObjectId.is_valid(stream_id) else None
+    if not stream or stream.api_key != api_key:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Stream not found")
+    return stream
+
+
+@router.post("/streams", status_code=status.HTTP_201_CREATED)
+async def start_stream(body: StreamRequest, api_key: str = Security(get_api_key)):
+    stream = VideoStream(
+        source=body.source,
+        name=body.name or body.source,
+        api_key=str(api_key),
+        window_seconds=body.window_seconds or settings.STREAM_WINDOW_SECONDS,
+        created_at=datetime.utcnow(),
+    )
+    if stream.window_seconds <= 0:
+        raise HTTPException(status_code=status.HTTP_422_UNPROCESSABLE_ENTITY, detail="window_seconds must be positive")
+    try:
+        streams.check_source(stream.source)
+    except streams.SourceNotAllowed as e:
+        raise HTTPException(status_code=status.HTTP_422_UNPROCESSABLE_ENTITY, detail=str(e))
+    await stream.insert()
+    try:
+        await streams.start(stream)
+    except streams.StreamLimit as e:
+        await stream.delete()
+        raise HTTPException(status_code=status.HTTP_503_SERVICE_UNAVAILABLE, detail=str(e))
+    return describe_stream(stream)
+
+
+@router.get("/streams")
+async def list_streams(api_key: str = Security(get_api_key)):
+    found = await VideoStream.find(VideoStream.api_key == api_key).to_list()
+    return {"streams": [describe_stream(stream) for stream in found]}
+
+
+@router.get("/streams/{stream_id}")
+async def get_stream_status(stream_id: str, api_key: str = Security(get_api_key)):
+    return describe_stream(await get_stream(stream_id, api_key))
+
+
+@router.get("/streams/{stream_id}/windows")
+async def get_stream_windows(stream_id: str, limit: int = 60, api_key: str = Security(get_api_key)):
+    stream = await get_stream(stream_id, api_key)
+    windows = await VideoResponse.find(VideoResponse.stream_id == str(stream.id)).sort(-VideoResponse.window_start).limit(limit).to_list()
+    return {"windows": await reports.expand(windows)}
+
+
+@router.delete("/streams/{stream_id}")
+async def stop_stream(stream_id: str, api_key: str = Security(get_api_key)):
+    stream = await get_stream(stream_id, api_key)
+    if stream.status == "running":
+        await streams.stop(stream)
+    return describe_stream(stream)
@@ -3,7 +3,9 @@ from fastapi import APIRouter, Depends, HTTPException, status
 from ..models.user import User, UserResponse, UserUpdate
 from .. import oauth2
 from .. import utils
+from .. import profiles
 from fastapi_jwt_auth import AuthJWT
+from pymongo.errors import DuplicateKeyError
 
 
 router = APIRouter()
@@ -11,7 +13,7 @@ router = APIRouter()
 
 @router.get("/me", response_model=UserResponse)
 async def get_me(user_id: str = Depends(oauth2.require_user)):
-    user = await User.get(str(user_id))
+    user = await oauth2.get_user(user_id)
     r_user = UserResponse(
         username=user.username,
         email=user.email,
@@ -32,59 +34,68 @@ async def update_me(
     Authorize: AuthJWT = Depends(),
 ):
     user = await User.get(str(user_id))
+    old_username = user.username
+
+    if user_update.email != user.email and not utils.is_valid_email(user_update.email):
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST, detail="Invalid email"
+        )
+    if user_update.phone_number != user.phone_number and not utils.is_valid_phone_number(user_update.phone_number):
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST, detail="Invalid phone number"
+        )
+
+    # One query for every changed field that must stay unique
+    changed = {
+        field: value
+        for field, value in user_update.dict().items()
+        if value != getattr(user, field)
+    }
+    if changed:
+        taken = await User.find_one(
+            {"_id": {"$ne": user.id}, "$or": [{field: value} for field, value in changed.items()]}
+        )
+        for field, detail in (
+            ("username", "Username already exists"),
+            ("email", "Email already exists"),
+            ("phone_number", "Phone number already exists"),
+        ):
+            if taken and field in changed and getattr(taken, field) == changed[field]:
+                raise HTTPException(status_code=status.HTTP_409_CONFLICT, detail=detail)
+
+    # Refused before anything changes if the verification email could not be queued
+    email_changed = user_update.email != user.email
+    if email_changed:
+        utils.check_mail_queue()
 
     # Update user attributes
     if user_update.username != user.username:
-        user_exists = await User.find_one(User.username == user_update.username)
-        if user_exists:
-            raise HTTPException(
-                status_code=status.HTTP_409_CONFLICT,
-                detail="Username already exists",
-            )
         user.username = user_update.username
-    if user_update.email != user.email:
-        if not utils.is_valid_email(user_update.email):
-            raise HTTPException(
-                status_code=status.HTTP_400_BAD_REQUEST, detail="Invalid email"
-            )
-        email_exists = await User.find_one(User.email == user_update.email)
-        if email_exists:
-            raise HTTPException(
-                status_code=status.HTTP_409_CONFLICT,
-                detail="Email already exists",
-            )
-        old_email = user.email  # Store the old email for logging out
+    if email_changed:
         user.email = user_update.email
-        verification_code = utils.generate_verification_code()
-        await utils.send_verification_email(user.email, verification_code)
-        user.verification_code = verification_code
+        # Sent once the change is saved
+        user.verification_code = utils.generate_verification_code()
         user.is_verified = False
 
         # Log out the user if email is updated
         Authorize.unset_jwt_cookies()
 
     if user_update.phone_number != user.phone_number:
-        if not utils.is_valid_phone_number(user_update.phone_number):
-            raise HTTPException(
-                status_code=status.HTTP_400_BAD_REQUEST, detail="Invalid phone number"
-            )
-        phone_number_exists = await User.find_one(
-            User.phone_number == user_update.phone_number
-        )
-        if phone_number_exists:
-            raise HTTPException(
-                status_code=status.HTTP_409_CONFLICT,
-                detail="Phone number already exists",
-            )
         user.phone_number = user_update.phone_number
 
-    user_exists = await User.find_one(User.username == user_update.username)
-    email_exists = await User.find_one(User.email == user_update.email)
-    phone_number_exists = await User.find_one(
-        User.phone_number == user_update.phone_number
-    )
     # Save the updated user back to the database
-    await user.save()
+    try:
+        await user.save()
+    except DuplicateKeyError:
+        # Taken concurrently since the check above
+        raise HTTPException(
+            status_code=status.HTTP_409_CONFLICT,
+            detail="Username, email or phone number already exists",
+        )
+    oauth2.invalidate_user(user_id)
+    profiles.invalidate(old_username, user.username)
+    if email_changed:
+        await utils.send_verification_email(user.email, user.verification_code)
 
     # Return the updated user as a response
     return UserResponse(
@@ -103,14 +114,14 @@ async def change_password(
     user = await User.get(str(user_id))
 
     # Verify the old password
-    if not utils.verify_password(old_password, user.password):
+    if not await utils.verify_password(old_password, user.password):
         raise HTTPException(
             status_code=status.HTTP_401_UNAUTHORIZED,
             detail="Incorrect old password",
         )
 
     # Update the password with the new one
-    user.password = utils.hash_password(new_password)
+    user.password = await utils.hash_password(new_password)
 
     # Save the updated user back to the database
     await user.save()
@@ -127,6 +138,8 @@ async def delete_me(user_id: str = Depends(oauth2.require_user)):
 
     # Delete the user from the database
     await user.delete()
+    oauth2.invalidate_user(user_id)
+    profiles.invalidate(user.username)
 
     # Return the deleted user as a response
     return {"status": "account successfully deleted"}
@@ -0,0 +1,303 @@
+import asyncio
+import logging
+import math
+import os
+import threading
+import time
+import uuid
+from collections import deque
+from datetime import datetime, timedelta
+from urllib.parse import urlsplit
+
+import cv2
+import numpy as np
+
+from .config.settings import settings
+from .models.stream import VideoStream
+from .class_map import load_class_map
+from . import workers, inference, metrics
+
+logger = logging.getLogger(__name__)
+
+# Each running stream is claimed by one API process through its owner field,
+# renewed by a heartbeat, so with several uvicorn workers a camera is opened
+# once. A stop written by another process ends the session at its next heartbeat.
+process_id = uuid.uuid4().hex
+sessions = {}  # stream id -> StreamSession of the streams running in this process
+report = None  # async report(stream, window_start, window_end, seconds per name)
+class_map_path = None
+
+
+class StreamLimit(Exception):
+    pass
+
+
+class SourceNotAllowed(Exception):
+    pass
+
+
+metrics.QUEUE_DEPTH.labels("stream_frames").set_function(lambda: sum(len(s.queue.frames) for s in list(sessions.values())))
+
+
+class FrameQueue:
+    # Bounded hand-off from the capture thread to the inference loop. A full
+    # queue drops its oldest frame, so however far inference falls behind the
+    # frames it gets are never more than maxlen frames old.
+
+    def __init__(self, maxlen: int):
+        self.frames = deque(maxlen=max(1, maxlen))
+        self.ready = threading.Condition()
+        self.dropped = 0
+        self.closed = False
+
+    def put(self, timestamp: float, frame):
+        with self.ready:
+            if len(self.frames) == self.frames.maxlen:
+                self.dropped += 1
+                metrics.frames("stream_dropped", 1)
+            self.frames.append((timestamp, frame))
+            self.ready.notify()
+
+    def close(self):
+        with self.ready:
+            self.closed = True
+            self.ready.notify()
+
+    def take(self, n: int, timeout: float) -> list:
+        with self.ready:
+            self.ready.wait_for(lambda: self.frames or self.closed, timeout)
+            return [self.frames.popleft() for _ in range(min(n, len(self.frames)))]
+
+
+def check_source(source: str):
+    # Only network streams from STREAM_SCHEMES (and STREAM_HOSTS when set);
+    # camera indexes and server file paths only with STREAM_ALLOW_LOCAL
+    if source.isdigit() or "://" not in source:
+        if not settings.STREAM_ALLOW_LOCAL:
+            raise SourceNotAllowed("Local devices and files are not allowed as stream sources")
+        return
+    url = urlsplit(source)
+    schemes = {s.strip().lower() for s in settings.STREAM_SCHEMES.split(",") if s.strip()}
+    if url.scheme.lower() not in schemes:
+        raise SourceNotAllowed(f"Stream sources must use one of: {', '.join(sorted(schemes))}")
+    hosts = {h.strip().lower() for h in settings.STREAM_HOSTS.split(",") if h.strip()}
+    if hosts and (url.hostname or "").lower() not in hosts:
+        raise SourceNotAllowed(f"Stream host {url.hostname} is not allowed")
+
+
+def open_source(source: str):
+    # Camera devices are given by index
+    return cv2.VideoCapture(int(source) if source.isdigit() else source)
+
+
+def shrink(frame, size: int):
+    # The model resizes to its input size anyway; doing it here keeps the
+    # queue small and the frames cheap to send to the inference processes
+    shape = inference.scaled_shape(*frame.shape[:2], size)
+    if shape == frame.shape[:2]:
+        return frame
+    return cv2.resize(frame, shape[::-1], interpolation=cv2.INTER_LINEAR)
+
+
+class StreamSession:
+
+    def __init__(self, stream: VideoStream):
+        self.stream = stream
+        self.queue = FrameQueue(settings.STREAM_QUEUE_SIZE)
+        self.stopping = threading.Event()
+        self.shutdown = False
+        self.released = False  # stopped or taken over through the database
+        self.captured = 0
+        self.analysed = 0
+        self.latency = None
+        self.thread = threading.Thread(target=self.capture, daemon=True)
+        self.task = None
+
+    def stats(self) -> dict:
+        return {
+            "captured_frames": self.captured,
+            "analysed_frames": self.analysed,
+            "dropped_frames": self.queue.dropped,
+            "latency": round(self.latency, 3) if self.latency is not None else None,
+        }
+
+    def capture(self):
+        # Live sources must be drained continuously whatever inference does,
+        # so reading happens in its own thread. Local files are replayed at
+        # real-time speed so they behave like a camera.
+        replay = os.path.isfile(self.stream.source)
+        try:
+            while not self.stopping.is_set():
+                cap = open_source(self.stream.source)
+                fps = cap.get(cv2.CAP_PROP_FPS) if replay else 0
+                started = time.monotonic()
+                index = 0
+                while not self.stopping.is_set():
+                    ret, frame = cap.read()
+                    if not ret:
+                        break
+                    if fps:
+                        delay = started + index / fps - time.monotonic()
+                        if delay > 0:
+                            time.sleep(delay)
+                    index += 1
+                    self.captured += 1
+                    self.queue.put(time.time(), shrink(frame, settings.STREAM_FRAME_SIZE))
+                cap.release()
+                if replay:
+                    break
+                logger.warning("Stream lost, reconnecting", extra={"stream": self.stream.name})
+                self.stopping.wait(settings.STREAM_RECONNECT_SECONDS)
+        finally:
+            self.queue.close()
+
+    async def send_report(self, class_map, start: float, end: float, seconds: np.ndarray):
+        try:
+            await report(self.stream, datetime.utcfromtimestamp(start), datetime.utcfromtimestamp(end), class_map.totals(seconds))
+        except Exception as e:
+            logger.error("Failed to save stream window", extra={"stream": self.stream.name, "error": str(e)})
+
+    async def analyse(self, class_map):
+        length = self.stream.window_seconds
+        window = previous = None
+        seconds = np.zeros(len(class_map.names))
+
+        while True:
+            frames = await asyncio.to_thread(self.queue.take, inference.batch_size, 1)
+            if not frames:
+                if self.queue.closed or self.stopping.is_set():
+                    break
+                # Close the window on time even when the source has gone quiet
+                if window is not None and time.time() >= window + length:
+                    await self.send_report(class_map, window, window + length, seconds)
+                    window = None
+                    seconds = np.zeros(len(class_map.names))
+                continue
+
+            presence = await workers.run(inference.detect_presence, [frame for _, frame in frames], class_map, bounded=False)
+            self.analysed += len(frames)
+            self.latency = time.time() - frames[-1][0]
+            metrics.stage("stream_latency", self.latency)
+
+            for (timestamp, _), present in zip(frames, presence):
+                start = math.floor(timestamp / length) * length
+                if window is not None and start != window:
+                    await self.send_report(class_map, window, window + length, seconds)
+                    window = None
+                    seconds = np.zeros(len(class_map.names))
+                if window is None:
+                    window = start
+                # An analysed frame stands for the time since the previous one,
+                # dropped frames included
+                if previous is not None and 0 < timestamp - previous <= settings.STREAM_MAX_GAP_SECONDS:
+                    seconds += present * (timestamp - previous)
+                previous = timestamp
+
+        # The last, partial window
+        if window is not None:
+            await self.send_report(class_map, window, min(window + length, previous), seconds)
+
+    async def heartbeat(self):
+        while not self.stopping.is_set():
+            await asyncio.sleep(settings.STREAM_HEARTBEAT_SECONDS)
+            kept = await VideoStream.get_motor_collection().update_one(
+                {"_id": self.stream.id, "owner": process_id, "status": "running"},
+                {"$set": {"heartbeat_at": datetime.utcnow()}},
+            )
+            if not kept.matched_count:
+                logger.info("Stream stopped elsewhere", extra={"stream": self.stream.name})
+                self.released = True
+                self.stopping.set()
+
+    async def run(self):
+        self.thread.start()
+        heartbeat = asyncio.create_task(self.heartbeat())
+        status, error = "finished", None
+        try:
+            await self.analyse(load_class_map(class_map_path))
+        except Exception as e:
+            logger.error("Stream failed", extra={"stream": self.stream.name, "error": str(e)})
+            status, error = "failed", str(e)
+        finally:
+            self.stopping.set()
+            heartbeat.cancel()
+            sessions.pop(self.stream.id, None)
+
+        if self.released:
+            return
+        if self.shutdown:
+            # Left running and unclaimed so it resumes on the next start
+            await VideoStream.get_motor_collection().update_one(
+                {"_id": self.stream.id, "owner": process_id}, {"$set": {"owner": None}}
+            )
+            return
+        if self.stream.status == "running":
+            self.stream.status = status
+        await self.stream.set(
+            {
+                VideoStream.status: self.stream.status,
+                VideoStream.error: error,
+                VideoStream.stopped_at: datetime.utcnow(),
+                VideoStream.owner: None,
+            }
+        )
+
+
+def unclaimed() -> dict:
+    # Running streams no live process holds
+    stale = datetime.utcnow() - timedelta(seconds=3 * settings.STREAM_HEARTBEAT_SECONDS)
+    return {"status": "running", "$or": [{"owner": None}, {"heartbeat_at": {"$lt": stale}}]}
+
+
+async def start(stream: VideoStream):
+    # The session, or None when another process claimed the stream first
+    check_source(stream.source)
+    collection = VideoStream.get_motor_collection()
+    running = await collection.count_documents({"status": "running"}) - await collection.count_documents(unclaimed())
+    if len(sessions) >= max(0, settings.MAX_STREAMS) or running >= max(0, settings.MAX_STREAMS):
+        raise StreamLimit("Too many streams are running")
+    claimed = await collection.update_one(
+        {"_id": stream.id, **unclaimed()}, {"$set": {"owner": process_id, "heartbeat_at": datetime.utcnow()}}
+    )
+    if not claimed.modified_count:
+        return None
+    stream.owner = process_id
+    session = StreamSession(stream)
+    sessions[stream.id] = session
+    session.task = asyncio.create_task(session.run())
+    return session
+
+
+async def stop(stream: VideoStream):
+    session = sessions.get(stream.id)
+    stream.status = "stopped"
+    if session:
+        session.stream.status = "stopped"
+        session.stopping.set()
+        await session.task
+    else:
+        # Run by another process, which notices at its next heartbeat
+        await stream.set({VideoStream.status: "stopped", VideoStream.stopped_at: datetime.utcnow()})
+
+
+async def start_streams(report_window, names_file: str):
+    global report, class_map_path
+    report = report_window
+    class_map_path = names_file
+
+    # Resume the streams that were running before the last shutdown and that
+    # no other process has taken
+    for stream in await VideoStream.find(unclaimed()).to_list():
+        try:
+            await start(stream)
+        except StreamLimit:
+            await stream.set({VideoStream.status: "failed", VideoStream.error: "Stream limit reached after restart"})
+        except SourceNotAllowed as e:
+            await stream.set({VideoStream.status: "failed", VideoStream.error: str(e)})
+
+
+async def stop_streams():
+    for session in list(sessions.values()):
+        session.shutdown = True
+        session.stopping.set()
+    await asyncio.gather(*[session.task for session in list(sessions.values())], return_exceptions=True)
@@ -0,0 +1,63 @@
+from collections import Counter
+from types import SimpleNamespace
+
+import numpy as np
+from ultralytics.trackers.byte_tracker import BYTETracker
+
+from .config.settings import settings
+
+
+# Detections below this never reach the tracker; ByteTrack uses the ones
+# between it and TRACK_HIGH_THRESH to keep existing tracks alive
+TRACK_LOW_THRESH = 0.1
+
+
+class PresenceTracker:
+    # Runs ByteTrack over detector keyframes and turns the tracks into
+    # per-person presence. Between keyframes every live track is carried by
+    # its Kalman filter; the time a track spends lost before it is found again
+    # is credited to its person, so short detector misses do not cut durations.
+
+    def __init__(self, class_map, fps: float, keyframe_interval: int):
+        lost_keyframes = max(1, round(settings.TRACK_MAX_LOST_SECONDS * (fps or 30) / keyframe_interval))
+        args = SimpleNamespace(
+            track_high_thresh=settings.TRACK_HIGH_THRESH,
+            track_low_thresh=TRACK_LOW_THRESH,
+            new_track_thresh=settings.TRACK_HIGH_THRESH,
+            track_buffer=lost_keyframes,
+            match_thresh=0.8,
+            fuse_score=True,
+        )
+        # With frame_rate=30 ByteTrack keeps lost tracks for track_buffer updates
+        self.tracker = BYTETracker(args, frame_rate=30)
+        self.class_map = class_map
+        self.votes = {}  # track id -> detected class counts
+        self.last_seen = {}  # track id -> last keyframe it was matched in
+        self.weights = []  # frames covered by each keyframe
+        self.present = []  # person indices present after each keyframe
+
+    def update(self, result, weight: int):
+        keyframe = len(self.weights)
+        self.weights.append(weight)
+        self.present.append(set())
+
+        for track in self.tracker.update(result.boxes.cpu().numpy()):
+            track_id, cls = int(track[4]), int(track[6])
+            # A track's person is the class it was most often detected as
+            votes = self.votes.setdefault(track_id, Counter())
+            votes[cls] += 1
+            cls = votes.most_common(1)[0][0]
+            if cls >= len(self.class_map.matrix):
+                continue
+
+            people = np.flatnonzero(self.class_map.matrix[cls])
+            first = self.last_seen.get(track_id, keyframe - 1) + 1
+            for k in range(first, keyframe + 1):
+                self.present[k].update(people.tolist())
+            self.last_seen[track_id] = keyframe
+
+    def counts(self) -> np.ndarray:
+        counts = np.zeros(len(self.class_map.names), np.int64)
+        for weight, people in zip(self.weights, self.present):
+            counts[list(people)] += weight
+        return counts
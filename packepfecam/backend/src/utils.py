@@ -1,14 +1,18 @@
+import asyncio
 import base64
+import time
+from concurrent.futures import ThreadPoolExecutor
 from urllib.parse import parse_qs
 from dotenv import load_dotenv
 from passlib.context import CryptContext
 import re
 import secrets
-import smtplib
 from email.mime.text import MIMEText
 from email.mime.multipart import MIMEMultipart
 from datetime import datetime, timedelta
 from .models.response import ImageResponse
+from .config.settings import settings
+from . import metrics, mailer
 from fastapi import HTTPException
 import json
 
@@ -30,52 +34,74 @@ def is_valid_phone_number(phone_number: str) -> bool:
 
 pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
 
+# bcrypt takes hundreds of milliseconds and releases the GIL, so it runs on
+# its own few threads: a burst of logins queues there instead of blocking the
+# event loop, and past PASSWORD_HASH_QUEUE_SIZE waiting calls it is refused
+password_executor = ThreadPoolExecutor(max_workers=max(1, settings.PASSWORD_HASH_THREADS), thread_name_prefix="bcrypt")
+password_pending = 0
+metrics.QUEUE_DEPTH.labels("password_hash").set_function(lambda: password_pending)
 
-def hash_password(password: str):
-    return pwd_context.hash(password)
 
+def timed_call(fn, *args):
+    started = time.monotonic()
+    return fn(*args), started
 
-def verify_password(password: str, hashed_password: str):
-    return pwd_context.verify(password, hashed_password)
+
+async def run_password_hash(fn, *args):
+    global password_pending
+    if password_pending >= max(1, settings.PASSWORD_HASH_THREADS) + settings.PASSWORD_HASH_QUEUE_SIZE:
+        raise HTTPException(
+            status_code=503,
+            detail="Too many sign-ins at once, try again shortly",
+            headers={"Retry-After": "1"},
+        )
+
+    password_pending += 1
+    try:
+        submitted = time.monotonic()
+        result, started = await asyncio.get_running_loop().run_in_executor(password_executor, timed_call, fn, *args)
+        metrics.stage("password_hash_queue_wait", started - submitted)
+        metrics.stage("password_hash", time.monotonic() - started)
+        return result
+    finally:
+        password_pending -= 1
+
+
+async def hash_password(password: str):
+    return await run_password_hash(pwd_context.hash, password)
+
+
+async def verify_password(password: str, hashed_password: str):
+    return await run_password_hash(pwd_context.verify, password, hashed_password)
 
 
 def generate_verification_code():
     return secrets.token_urlsafe(6)
 
 
-def get_smtp_connection():
-    smtp_server = "smtp.sendgrid.net"
-    smtp_port = 587
-    smtp_username = "apikey"
-    smtp_password = sendgrid_api_key
-    smtp_from_email = "oussema.benhassena@horizon-tech.tn"
-    return smtp_server, smtp_port, smtp_username, smtp_password, smtp_from_email
+def check_mail_queue():
+    # Called before saving a change that needs a verification email
+    try:
+        mailer.check_room()
+    except mailer.MailQueueFull as e:
+        raise HTTPException(status_code=503, detail=str(e), headers={"Retry-After": "10"})
 
 
 async def send_verification_email(to_email: str, verification_code: str):
-    (
-        smtp_server,
-        smtp_port,
-        smtp_username,
-        smtp_password,
-        smtp_from_email,
-    ) = get_smtp_connection()
-
     # Create the MIME message
     subject = "Email Verification Code"
     body = f"Your verification code is: {verification_code}"
 
     message = MIMEMultipart()
-    message["From"] = smtp_from_email
+    message["From"] = settings.SMTP_FROM_EMAIL
     message["To"] = to_email
     message["Subject"] = subject
     message.attach(MIMEText(body, "plain"))
 
-    # Connect to the SMTP server and send the email
-    with smtplib.SMTP(smtp_server, smtp_port) as server:
-        server.starttls()
-        server.login(smtp_username, smtp_password)
-        server.sendmail(smtp_from_email, to_email, message.as_string())
+    # Sent in the background by the mailer, see mailer.py. The change it
+    # confirms is already saved, so a full queue defers the mail instead of
+    # failing the request.
+    mailer.submit(message, defer=True)
 
 
 
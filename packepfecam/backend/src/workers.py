@@ -0,0 +1,99 @@
+import asyncio
+import functools
+import logging
+import multiprocessing
+import os
+import uuid
+from concurrent.futures import ProcessPoolExecutor
+
+from .config.settings import settings
+from . import inference, metrics
+
+logger = logging.getLogger(__name__)
+
+pool: ProcessPoolExecutor = None
+manager = None
+progress = None
+pending = 0
+freed: asyncio.Condition = None  # notified whenever a call finishes
+ready = False
+
+
+class PoolBusy(Exception):
+    pass
+
+
+metrics.QUEUE_DEPTH.labels("inference").set_function(lambda: pending)
+
+
+def start_pool():
+    global pool, manager, progress, freed
+    freed = asyncio.Condition()
+    # forkserver keeps the children clear of the event loop and Mongo client threads
+    context = multiprocessing.get_context("forkserver")
+    context.set_forkserver_preload([f"{__package__}.preload"])
+    manager = context.Manager()
+    progress = manager.dict()
+    processes = max(1, settings.INFERENCE_PROCESSES)
+    threads = max(1, (os.cpu_count() or 1) // processes)
+    pool = ProcessPoolExecutor(
+        max_workers=processes,
+        mp_context=context,
+        initializer=inference.init_worker,
+        initargs=(progress, threads),
+    )
+
+
+async def warm_up():
+    # Start every process now so model loading and warm-up never hit a request
+    global ready
+    processes = max(1, settings.INFERENCE_PROCESSES)
+    barrier = manager.Barrier(processes)
+    try:
+        pids = await asyncio.gather(*[run(inference.ready, barrier, bounded=False) for _ in range(processes)])
+    except Exception as e:
+        logger.error("Inference warm-up failed", extra={"error": str(e)})
+        return
+    ready = True
+    logger.info("Inference processes are ready", extra={"pids": sorted(pids)})
+
+
+def stop_pool(wait: bool = False):
+    pool.shutdown(wait=wait, cancel_futures=True)
+    manager.shutdown()
+
+
+def full() -> bool:
+    return pending >= max(1, settings.INFERENCE_PROCESSES) + settings.INFERENCE_QUEUE_SIZE
+
+
+async def run(fn, *args, on_progress=None, bounded=True, wait=False, **kwargs):
+    # Run fn in an inference process; at most INFERENCE_QUEUE_SIZE calls wait for a free one.
+    # When they are all taken a bounded call raises PoolBusy, or with wait
+    # waits until one is free. Video jobs pass bounded=False as they are
+    # already limited by JOB_WORKERS.
+    global pending
+    while bounded and full():
+        if not wait:
+            raise PoolBusy("Inference workers are busy, try again later")
+        async with freed:
+            await freed.wait()
+
+    pending += 1
+    key = uuid.uuid4().hex if on_progress else None
+    try:
+        if key:
+            fn = functools.partial(fn, progress_key=key)
+        future = asyncio.get_running_loop().run_in_executor(pool, functools.partial(metrics.call, fn, *args, **kwargs))
+        while on_progress and not future.done():
+            await asyncio.wait([future], timeout=1)
+            await on_progress(progress.get(key, 0))
+        result, observations = await future
+        metrics.replay(observations)
+        return result
+    finally:
+        pending -= 1
+        async with freed:
+            freed.notify()
+        if key:
+            progress.pop(key, None)
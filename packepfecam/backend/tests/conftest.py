@@ -0,0 +1,17 @@
+import os
+import sys
+
+# The settings module reads these at import; the tests never connect to anything
+for name, value in {
+    "DATABASE_URL": "mongodb://localhost:27017/test",
+    "MONGO_INITDB_DATABASE": "test",
+    "JWT_PUBLIC_KEY": "test",
+    "JWT_PRIVATE_KEY": "test",
+    "REFRESH_TOKEN_EXPIRES_IN": "60",
+    "ACCESS_TOKEN_EXPIRES_IN": "15",
+    "JWT_ALGORITHM": "RS256",
+    "CLIENT_ORIGIN": "http://localhost:3000",
+}.items():
+    os.environ.setdefault(name, value)
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
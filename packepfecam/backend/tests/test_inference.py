@@ -0,0 +1,101 @@
+import types
+
+import cv2
+import numpy as np
+import pytest
+import torch
+
+from src import inference
+from src.class_map import ClassMap
+from src.config.settings import settings
+
+# analyse_video against a stub model that "detects" the class written into
+# each frame's brightness, so the expected counts can be worked out per frame
+
+SIZE = 64
+LEVELS = [0, 80, 160, 240]  # frame brightness -> class 0..3
+FRAMES = 101
+
+
+def frame_class(frame: np.ndarray) -> int:
+    return int(np.argmin([abs(float(frame.mean()) - level) for level in LEVELS]))
+
+
+class StubModel:
+    overrides = {"imgsz": SIZE}
+
+    def __call__(self, frames, **kwargs):
+        return [types.SimpleNamespace(boxes=types.SimpleNamespace(cls=torch.tensor([float(frame_class(f))]))) for f in frames]
+
+
+@pytest.fixture(scope="module")
+def video(tmp_path_factory):
+    path = str(tmp_path_factory.mktemp("videos") / "levels.avi")
+    writer = cv2.VideoWriter(path, cv2.VideoWriter_fourcc(*"MJPG"), 25, (SIZE, SIZE))
+    for index in range(FRAMES):
+        # Runs of varying length so strides land on different classes
+        writer.write(np.full((SIZE, SIZE, 3), LEVELS[(index // 3 + index // 7) % len(LEVELS)], np.uint8))
+    writer.release()
+    return path
+
+
+@pytest.fixture
+def class_map():
+    return ClassMap([{"name": f"person{c}", "class": c} for c in range(len(LEVELS))])
+
+
+@pytest.fixture(autouse=True)
+def stub_model(monkeypatch):
+    monkeypatch.setattr(inference, "model", StubModel())
+    monkeypatch.setattr(settings, "MAX_ANALYSED_FPS", 0)
+    monkeypatch.setattr(settings, "PROCESSING_TIME_BUDGET", 0)
+
+
+def per_frame_counts(path: str, stride: int) -> dict:
+    # Every sampled frame stands for itself and the stride - 1 frames skipped after it
+    cap = cv2.VideoCapture(path)
+    frames = []
+    while True:
+        ret, frame = cap.read()
+        if not ret:
+            break
+        frames.append(frame)
+    cap.release()
+    counts = {f"person{c}": 0 for c in range(len(LEVELS))}
+    for index in range(0, len(frames), stride):
+        counts[f"person{frame_class(frames[index])}"] += min(stride, len(frames) - index)
+    return counts
+
+
+@pytest.mark.parametrize("batch_size", [1, 4, 16])
+@pytest.mark.parametrize("stride", [1, 3, 7])
+def test_batched_counts_match_per_frame(monkeypatch, video, class_map, stride, batch_size):
+    monkeypatch.setattr(inference, "batch_size", batch_size)
+    counts, fps = inference.analyse_video(video, class_map, stride=stride, tracking=False)
+    assert counts == per_frame_counts(video, stride)
+    assert sum(counts.values()) == FRAMES
+    assert fps == 25
+
+
+@pytest.mark.parametrize("segments", [2, 3, 5])
+@pytest.mark.parametrize("stride", [1, 4])
+def test_segments_add_up_to_sequential_run(monkeypatch, video, class_map, stride, segments):
+    monkeypatch.setattr(inference, "batch_size", 4)
+    sequential, _ = inference.analyse_video(video, class_map, stride=stride, tracking=False)
+    ranges = inference.split_segments(FRAMES, segments, stride, min_frames=10)
+    assert len(ranges) == segments
+    assert ranges[0][0] == 0 and ranges[-1][1] == FRAMES
+    assert all(end == start for (_, end), (start, _) in zip(ranges, ranges[1:]))
+
+    total = dict.fromkeys(sequential, 0)
+    for start, end in ranges:
+        counts, _ = inference.analyse_video(video, class_map, stride=stride, tracking=False, start=start, end=end)
+        for name, count in counts.items():
+            total[name] += count
+    assert total == sequential
+
+
+def test_split_segments_start_on_stride():
+    for start, _ in inference.split_segments(1000, 4, 7, min_frames=30):
+        assert start % 7 == 0
+    assert inference.split_segments(50, 4, 1, min_frames=30) == [(0, 50)]